@@ -123,6 +123,25 @@ STATIC_ROOT = CF.STATIC_ROOT
 ARCHIVESSPACE = CF.ARCHIVESSPACE
 URSA_MAJOR = CF.URSA_MAJOR
 AURORA = CF.AURORA
+HTTP_CLIENT = CF.HTTP_CLIENT
+
+ROUTINE_WORKERS = CF.ROUTINE_WORKERS
+ASYNC_ROUTINES = CF.ASYNC_ROUTINES
+ISOLATE_FAILURES = CF.ISOLATE_FAILURES
+RETRY_DELAY = CF.RETRY_DELAY
+RETRY_MAX_DELAY = CF.RETRY_MAX_DELAY
+RETRY_MAX_ATTEMPTS = CF.RETRY_MAX_ATTEMPTS
+CLAIM_BATCH_SIZE = CF.CLAIM_BATCH_SIZE
+CLAIM_LEASE = CF.CLAIM_LEASE
+JOB_LEASE = CF.JOB_LEASE
+
+AGENT_CACHE_SIZE = CF.AGENT_CACHE_SIZE
+AGENT_CACHE_TTL = CF.AGENT_CACHE_TTL
+AGENT_CACHE_LOCAL_TTL = CF.AGENT_CACHE_LOCAL_TTL
+
+PACKAGE_PAGE_SIZE = CF.PACKAGE_PAGE_SIZE
+PACKAGE_MAX_PAGE_SIZE = CF.PACKAGE_MAX_PAGE_SIZE
+BULK_INGEST_BATCH_SIZE = CF.BULK_INGEST_BATCH_SIZE
 
 
 REST_FRAMEWORK = {
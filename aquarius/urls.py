@@ -18,7 +18,8 @@ from django.contrib import admin
 from django.urls import include
 from rest_framework import routers
 from rest_framework.schemas import get_schema_view
-from transformer.views import (AccessionUpdateRequestView, PackageViewSet,
+from transformer.views import (AccessionUpdateRequestView, JobViewSet,
+                               PackageViewSet, PipelineView,
                                ProcessAccessionsView,
                                ProcessDigitalObjectsView,
                                ProcessGroupingComponentsView,
@@ -27,6 +28,7 @@ from transformer.views import (AccessionUpdateRequestView, PackageViewSet,
 
 router = routers.DefaultRouter()
 router.register(r'packages', PackageViewSet, 'package')
+router.register(r'jobs', JobViewSet, 'job')
 
 schema_view = get_schema_view(
     title="Aquarius API",
@@ -41,6 +43,7 @@ urlpatterns = [
     url(r'^digital-objects/', ProcessDigitalObjectsView.as_view(), name="digital-objects"),
     url(r'^send-update/', TransferUpdateRequestView.as_view(), name="send-update"),
     url(r'^send-accession-update/', AccessionUpdateRequestView.as_view(), name="send-accession-update"),
+    url(r'^pipeline/', PipelineView.as_view(), name="pipeline"),
     url(r'^status/', include('health_check.api.urls')),
     url(r'^admin/', admin.site.urls),
     url(r'^schema/', schema_view, name='schema'),
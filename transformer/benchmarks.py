@@ -0,0 +1,251 @@
+import json
+import re
+import timeit
+import tracemalloc
+from collections import OrderedDict
+from copy import deepcopy
+from os import listdir
+from os.path import join
+from urllib.parse import urlparse
+
+from aquarius import settings
+from django.db import connection
+from odin.codecs import json_codec
+
+from .mappings import (SourceAccessionToArchivesSpaceAccession,
+                       SourceAccessionToGroupingComponent,
+                       SourceCreatorToArchivesSpaceAgentCorporateEntity,
+                       SourceCreatorToArchivesSpaceAgentFamily,
+                       SourceCreatorToArchivesSpaceAgentPerson,
+                       SourcePackageToDigitalObject,
+                       SourceTransferToTransferComponent, transform)
+from .models import Package
+from .resources.source import (SourceAccession, SourceCreator, SourcePackage,
+                               SourceTransfer)
+from .routines import Pipeline
+
+LINKED_AGENT = {"uri": "/agents/people/1"}
+NOTE_TEXT = "Records are open for research after expiration of the embargo period. "
+CREATOR_TYPES = ("person", "organization", "family")
+ACTS_PER_STATEMENT = 4
+
+
+def json_transform(data, from_resource, mapping):
+    """Applies a mapping by encoding to and parsing JSON, which is how
+    routines transformed data before `transform` was added."""
+    from_obj = json_codec.loads(json.dumps(data), resource=from_resource)
+    return json.loads(json_codec.dumps(mapping.apply(from_obj)))
+
+
+def load_responses():
+    """Returns the bags and accessions returned by Ursa Major in the test
+    cassettes."""
+    responses = {}
+    cassette_dir = join(settings.BASE_DIR, "fixtures/cassettes")
+    for file in sorted(listdir(cassette_dir)):
+        with open(join(cassette_dir, file), "r") as cassette:
+            for interaction in json.load(cassette)["interactions"]:
+                path = urlparse(interaction["request"]["uri"]).path
+                if re.match(r"^/(bags|accessions)/\d+/$", path) and interaction["response"]["status"]["code"] == 200:
+                    responses[path] = json.loads(interaction["response"]["body"]["string"])
+    bags = [r for path, r in sorted(responses.items()) if path.startswith("/bags/")]
+    accessions = [r for path, r in sorted(responses.items()) if path.startswith("/accessions/")]
+    return bags, accessions
+
+
+def get_samples():
+    """Returns a list of (name, data, from_resource, mapping) tuples for each
+    mapping used by routines, with data prepared as it is by `get_data`."""
+    bags, accessions = load_responses()
+    samples = []
+    for accession in accessions:
+        data = deepcopy(accession["data"])
+        data.update(accession_number="2020:001", linked_agents=[LINKED_AGENT])
+        samples.append(("Accession", data, SourceAccession, SourceAccessionToArchivesSpaceAccession))
+        data = deepcopy(accession["data"])
+        data.update(level="recordgrp", linked_agents=[LINKED_AGENT])
+        samples.append(("Grouping component", data, SourceAccession, SourceAccessionToGroupingComponent))
+    for bag in bags:
+        data = deepcopy(bag["data"])
+        data.update(resource="/repositories/2/resources/1", level="file", linked_agents=[LINKED_AGENT],
+                    archivesspace_parent_identifier="/repositories/2/archival_objects/1")
+        samples.append(("Transfer component", data, SourceTransfer, SourceTransferToTransferComponent))
+        data = {"fedora_uri": "http://fedora/rest/{}".format(bag["bag_identifier"]), "use_statement": "master"}
+        samples.append(("Digital object", data, SourcePackage, SourcePackageToDigitalObject))
+    return samples
+
+
+def compare_transforms(samples, number):
+    """Times both ways of applying each mapping, and checks that they produce
+    identical JSON.
+
+    Returns a list of (name, JSON codec seconds, dict seconds, identical)
+    tuples, where times are per transformation.
+    """
+    results = []
+    for name, data, from_resource, mapping in samples:
+        json_time = timeit.timeit(lambda: json_transform(data, from_resource, mapping), number=number) / number
+        dict_time = timeit.timeit(lambda: transform(data, from_resource, mapping), number=number) / number
+        expected = json.dumps(json_transform(data, from_resource, mapping))
+        results.append((name, json_time, dict_time, json.dumps(transform(data, from_resource, mapping)) == expected))
+    return results
+
+
+def scale_data(data, scale):
+    """Returns a copy of source data with `scale` rights statements, creators
+    and linked agents, and notes `scale` times as long as NOTE_TEXT."""
+    data = deepcopy(data)
+    note = NOTE_TEXT * scale
+    for key in ("description", "access_restrictions", "use_restrictions", "appraisal_note"):
+        if key in data:
+            data[key] = note
+    if "metadata" in data:
+        data["metadata"]["internal_sender_description"] = note
+        data["metadata"]["record_creators"] = scale_creators(scale)
+    if "creators" in data:
+        data["creators"] = scale_creators(scale)
+    if "linked_agents" in data:
+        data["linked_agents"] = [{"uri": "/agents/people/{}".format(i)} for i in range(scale)]
+    if "rights_statements" in data:
+        statements = []
+        for statement in (data["rights_statements"] * scale)[:scale]:
+            statement = deepcopy(statement)
+            statement["rights_granted"] = deepcopy((statement["rights_granted"] * ACTS_PER_STATEMENT)[:ACTS_PER_STATEMENT])
+            statements.append(statement)
+        data["rights_statements"] = statements
+    return data
+
+
+def scale_creators(scale):
+    return [{"name": "Creator {} {}".format(i, NOTE_TEXT[:40]), "type": CREATOR_TYPES[i % len(CREATOR_TYPES)]}
+            for i in range(scale)]
+
+
+def get_scaled_samples(scale):
+    """Returns samples for every mapping, including agent mappings, scaled
+    up with `scale_data`."""
+    samples = [(name, scale_data(data, scale), from_resource, mapping)
+               for name, data, from_resource, mapping in get_samples()]
+    name = "Smith, John Jacob " + " ".join(["Jingleheimer"] * scale)
+    for agent_type, mapping in (("person", SourceCreatorToArchivesSpaceAgentPerson),
+                                ("organization", SourceCreatorToArchivesSpaceAgentCorporateEntity),
+                                ("family", SourceCreatorToArchivesSpaceAgentFamily)):
+        samples.append(("Agent ({})".format(agent_type), {"name": name, "type": agent_type}, SourceCreator, mapping))
+    return samples
+
+
+def measure_mapping(data, from_resource, mapping, number):
+    """Measures a mapping applied to `data`.
+
+    Returns a dict containing the number of transformations per second, the
+    peak memory allocated by one transformation in bytes, and the number of
+    memory blocks allocated for its result.
+    """
+    seconds = timeit.timeit(lambda: transform(data, from_resource, mapping), number=number)
+    tracemalloc.start()
+    try:
+        transform(data, from_resource, mapping)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        result = transform(data, from_resource, mapping)
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+    del result
+    return {"per_second": number / seconds, "peak_bytes": peak, "blocks": blocks}
+
+
+def run_benchmarks(scale, number):
+    """Returns measurements for every mapping, keyed by sample name.
+
+    Samples which share a name, such as transfers from different bags, are
+    combined by averaging.
+    """
+    results = OrderedDict()
+    for name, data, from_resource, mapping in get_scaled_samples(scale):
+        result = measure_mapping(data, from_resource, mapping, number)
+        result["input_bytes"] = len(json.dumps(data))
+        results.setdefault(name, []).append(result)
+    return OrderedDict(
+        (name, {key: sum(r[key] for r in measured) / len(measured) for key in measured[0]})
+        for name, measured in results.items())
+
+
+def create_sample_packages(count):
+    """Creates `count` packages at the start status of each routine, with the
+    data recorded in the test cassettes, and returns a queryset of them."""
+    bags, accessions = load_responses()
+    packages = []
+    for routine in Pipeline.stages:
+        for i in range(count):
+            bag = deepcopy(bags[i % len(bags)])
+            data = accession_data = None
+            if routine.start_status > Package.SAVED:
+                data = bag
+                accession_data = deepcopy(accessions[i % len(accessions)])
+            if routine.start_status >= Package.TRANSFER_COMPONENT_CREATED:
+                data["data"]["archivesspace_identifier"] = "/repositories/2/archival_objects/{}".format(i)
+            packages.append(Package(
+                fedora_uri="http://fedora/rest/sample-{}-{}".format(routine.start_status, i),
+                bag_identifier="sample-{}".format(i), type="aip", origin="aurora",
+                process_status=routine.start_status, data=data, accession_data=accession_data))
+    Package.objects.bulk_create(packages)
+    return Package.objects.filter(fedora_uri__startswith="http://fedora/rest/sample-")
+
+
+def get_selected_bytes(queryset):
+    """Returns the size of the rows selected by a queryset, as text."""
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT coalesce(sum(octet_length(t::text)), 0) FROM ({}) AS t".format(sql), params)
+        return cursor.fetchone()[0]
+
+
+def compare_selected_bytes(packages):
+    """Returns (name, all fields, selected fields) tuples with the bytes
+    selected from `packages` by each routine and the package list, when all
+    fields are loaded and when unused JSON fields are deferred."""
+    results = []
+    for routine in Pipeline.stages:
+        queryset = packages.filter(process_status=routine.start_status)
+        results.append((routine.__name__, get_selected_bytes(queryset),
+                        get_selected_bytes(routine.select_fields(queryset))))
+    results.append(("Package list", get_selected_bytes(packages), get_selected_bytes(packages.with_json())))
+    return results
+
+
+def create_backlog(count):
+    """Creates `count` pending packages with the data recorded in the test
+    cassettes, and returns a queryset of them."""
+    bags, accessions = load_responses()
+    for start in range(0, count, 1000):
+        Package.objects.bulk_create([Package(
+            fedora_uri="http://fedora/rest/backlog-{}".format(i), bag_identifier="backlog-{}".format(i),
+            type="aip", origin="aurora", process_status=Package.TRANSFER_COMPONENT_CREATED,
+            data=bags[i % len(bags)], accession_data=accessions[i % len(accessions)])
+            for i in range(start, min(count, start + 1000))])
+    return Package.objects.filter(fedora_uri__startswith="http://fedora/rest/backlog-")
+
+
+def measure_backlog_memory(packages, batch_size):
+    """Returns the peak memory allocated, in bytes, while loading packages in
+    claimed batches of `batch_size`, as routines do, and while loading them
+    all at once."""
+    loads = (
+        lambda: [len(batch) for batch in packages.claim_batches("benchmark", batch_size)],
+        lambda: len(list(packages)),
+    )
+    results = []
+    for load in loads:
+        tracemalloc.start()
+        try:
+            load()
+            results.append(tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+    return results
@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from aquarius import settings
+from django.utils import timezone
+
+from .models import AgentReference
+
+
+def normalize_name(name):
+    """Collapses whitespace and case so that variant spellings of the same
+    name share a cache entry."""
+    return " ".join(name.split()).lower()
+
+
+class AgentCache:
+    """Resolves agents to ArchivesSpace URIs without making HTTP requests.
+
+    Entries are stored in the database as AgentReference objects, which are
+    shared by all processes, and held in an in-process LRU cache in front of
+    the database. Entries older than `ttl` seconds are ignored in both layers.
+
+    Entries are held in memory for at most `local_ttl` seconds, which is never
+    longer than `ttl`, before they are read from the database again, so that
+    entries invalidated by another process are no longer used after that time.
+    """
+
+    def __init__(self, size, ttl, local_ttl=None):
+        self.size = size
+        self.ttl = ttl
+        self.local_ttl = ttl if local_ttl is None else min(local_ttl, ttl)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, agent_type, name):
+        """Returns a cached URI, or None if the agent has not been resolved."""
+        key = (agent_type, normalize_name(name))
+        with self.lock:
+            if key in self.entries:
+                uri, expires = self.entries[key]
+                if expires > time.time():
+                    self.entries.move_to_end(key)
+                    return uri
+                del self.entries[key]
+        reference = AgentReference.objects.filter(
+            agent_type=key[0], name=key[1],
+            last_modified__gte=timezone.now() - timedelta(seconds=self.ttl)).first()
+        if reference:
+            expires = reference.last_modified.timestamp() + self.ttl
+            self.remember(key, reference.uri, expires)
+            return reference.uri
+
+    def set(self, agent_type, name, uri):
+        key = (agent_type, normalize_name(name))
+        AgentReference.objects.update_or_create(
+            agent_type=key[0], name=key[1], defaults={"uri": uri})
+        self.remember(key, uri, time.time() + self.ttl)
+
+    def invalidate(self, agent_type=None, name=None):
+        """Removes entries matching an agent type and/or name, or all entries.
+
+        Entries are removed from the database and from memory in this process.
+        Other processes stop using them within `local_ttl` seconds.
+        """
+        normalized = normalize_name(name) if name else None
+        with self.lock:
+            for key in list(self.entries):
+                if agent_type in (None, key[0]) and normalized in (None, key[1]):
+                    del self.entries[key]
+        references = AgentReference.objects.all()
+        if agent_type:
+            references = references.filter(agent_type=agent_type)
+        if normalized:
+            references = references.filter(name=normalized)
+        references.delete()
+
+    def remember(self, key, uri, expires):
+        with self.lock:
+            self.entries[key] = (uri, min(expires, time.time() + self.local_ttl))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+agent_cache = AgentCache(settings.AGENT_CACHE_SIZE, settings.AGENT_CACHE_TTL, settings.AGENT_CACHE_LOCAL_TTL)
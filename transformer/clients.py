@@ -1,14 +1,31 @@
+import asyncio
 import json
+import threading
+import time
 from datetime import date
+from functools import partial
 
 from asnake.client import ASnakeClient
 from electronbonder.client import ElectronBond
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+shared_clients = {}
+shared_clients_lock = threading.Lock()
 
 
 class ArchivesSpaceClientError(Exception):
     pass
 
 
+class AccessionNumberConflictError(ArchivesSpaceClientError):
+    pass
+
+
+class LockVersionConflictError(ArchivesSpaceClientError):
+    pass
+
+
 class UrsaMajorClientError(Exception):
     pass
 
@@ -17,12 +34,57 @@ class AuroraClientError(Exception):
     pass
 
 
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTP adapter which applies a default timeout to every request."""
+
+    def __init__(self, timeout=None, *args, **kwargs):
+        self.timeout = timeout
+        super(TimeoutHTTPAdapter, self).__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super(TimeoutHTTPAdapter, self).send(request, **kwargs)
+
+
+def configure_session(session, pool_size=10, max_retries=3, timeout=None):
+    """Mounts a connection pool with retries and a default timeout on a session.
+
+    Only idempotent requests are retried after a response has been received.
+    """
+    adapter = TimeoutHTTPAdapter(
+        timeout=timeout, pool_connections=pool_size, pool_maxsize=pool_size,
+        max_retries=Retry(total=max_retries, backoff_factor=0.3, status_forcelist=(502, 503, 504)))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def shared_client(client_class, *args, **kwargs):
+    """Returns a client instance shared by all callers in this process.
+
+    A client is created the first time it is requested with a given set of
+    arguments, after which its session, connections and authentication
+    token are reused.
+    """
+    key = (client_class, args, tuple(sorted(kwargs.items())))
+    with shared_clients_lock:
+        if key not in shared_clients:
+            shared_clients[key] = client_class(*args, **kwargs)
+        return shared_clients[key]
+
+
 class ArchivesSpaceClient(object):
     """Client to get and receive data from ArchivesSpace."""
 
-    def __init__(self, baseurl, username, password, repo_id):
+    ID_SET_SIZE = 250
+    RECENTLY_CREATED_WINDOW = 600
+
+    def __init__(self, baseurl, username, password, repo_id, pool_size=10, max_retries=3, timeout=None):
         self.client = ASnakeClient(baseurl=baseurl, username=username, password=password)
+        configure_session(self.client.session, pool_size, max_retries, timeout)
         self.repo_id = repo_id
+        self.recently_created = {}
         if not self.client.authorize():
             raise ArchivesSpaceClientError("Couldn't authenticate user credentials for ArchivesSpace")
         self.TYPE_LIST = {
@@ -34,18 +96,24 @@ class ArchivesSpaceClient(object):
             "digital object": ["digital_objects", "repositories/{repo_id}/digital_objects".format(repo_id=self.repo_id)]
         }
 
+    def request(self, method, url, **kwargs):
+        """Sends a request, logging in again if the session has expired."""
+        r = getattr(self.client, method)(url, **kwargs)
+        if r.status_code == 412:
+            self.client.authorize()
+            r = getattr(self.client, method)(url, **kwargs)
+        return r
+
     def send_request(self, method, url, data=None, **kwargs):
         """Base method for sending requests to ArchivesSpace."""
-        r = getattr(self.client, method)(url, data=json.dumps(data), **kwargs)
+        r = self.request(method, url, data=json.dumps(data), **kwargs)
         if r.status_code == 200:
             return r.json()
+        elif r.status_code == 409:
+            raise LockVersionConflictError("{} was modified by another request: {}".format(url, r.json()["error"]))
         else:
             if r.json()["error"].get("id_0"):
-                """Account for indexing delays by bumping up to the next accession number."""
-                id_1 = int(data["id_1"])
-                id_1 += 1
-                data["id_1"] = str(id_1).zfill(3)
-                return self.create(data, "accession")
+                raise AccessionNumberConflictError("Accession number {}:{} is already in use".format(data["id_0"], data["id_1"]))
             raise ArchivesSpaceClientError("Error sending {} request to {}: {}".format(method, url, r.json()["error"]))
 
     def retrieve(self, url, **kwargs):
@@ -57,27 +125,62 @@ class ArchivesSpaceClient(object):
     def update(self, uri, data, **kwargs):
         return self.send_request("post", uri, data, **kwargs)
 
+    def add_instances(self, uri, instances, attempts=3):
+        """Appends instances to an object with a single update.
+
+        If the object is modified by another request between being fetched and
+        updated, it is fetched again and the update is retried. Instances which
+        are already linked are not added again.
+        """
+        for _ in range(attempts):
+            obj = self.retrieve(uri)
+            linked = [i.get("digital_object", {}).get("ref") for i in obj["instances"]]
+            obj["instances"] += [i for i in instances if i.get("digital_object", {}).get("ref") not in linked]
+            try:
+                return self.update(uri, obj)
+            except LockVersionConflictError:
+                continue
+        raise ArchivesSpaceClientError("Could not update {} after {} attempts".format(uri, attempts))
+
     def get_or_create(self, type, field, value, last_updated, consumer_data):
         """
         Attempts to find and return an object in ArchivesSpace.
         If the object is not found, creates and returns a new object.
         """
         model_type = self.TYPE_LIST[type][0]
-        endpoint = self.TYPE_LIST[type][1]
         query = json.dumps({"query": {"field": field, "value": value, "jsonmodel_type": "field_query"}})
         try:
-            r = self.client.get("repositories/{}/search".format(self.repo_id), params={"page": 1, "type[]": model_type, "aq": query}).json()
+            r = self.request("get", "repositories/{}/search".format(self.repo_id), params={"page": 1, "type[]": model_type, "aq": query}).json()
             if len(r["results"]) == 0:
-                r = self.client.get(endpoint, params={"all_ids": True, "modified_since": last_updated - 120}).json()
-                for ref in r:
-                    r = self.client.get("{}/{}".format(endpoint, ref)).json()
-                    if r[field] == str(value):
-                        return r["uri"]
-                return self.create(consumer_data, type).get("uri")
+                uri = self.find_recently_modified(type, field, value, last_updated)
+                if not uri:
+                    uri = self.create(consumer_data, type).get("uri")
+                    self.recently_created[(type, field, str(value))] = (uri, time.time())
+                return uri
             return r["results"][0]["uri"]
         except Exception as e:
             raise ArchivesSpaceClientError("Error finding or creating object in ArchivesSpace: {}".format(e))
 
+    def find_recently_modified(self, type, field, value, last_updated):
+        """
+        Finds objects which are not yet in the search index.
+
+        Checks objects created by this client first, then fetches objects
+        modified since `last_updated` in batches using `id_set[]`.
+        """
+        now = time.time()
+        for key, (uri, created) in list(self.recently_created.items()):
+            if created < now - self.RECENTLY_CREATED_WINDOW:
+                self.recently_created.pop(key, None)
+        if (type, field, str(value)) in self.recently_created:
+            return self.recently_created[(type, field, str(value))][0]
+        endpoint = self.TYPE_LIST[type][1]
+        ids = self.request("get", endpoint, params={"all_ids": True, "modified_since": last_updated - 120}).json()
+        for i in range(0, len(ids), self.ID_SET_SIZE):
+            for obj in self.request("get", endpoint, params={"id_set[]": ids[i:i + self.ID_SET_SIZE]}).json():
+                if obj[field] == str(value):
+                    return obj["uri"]
+
     def next_accession_number(self):
         """
         Finds the next available accession number by searching for accession
@@ -89,7 +192,7 @@ class ArchivesSpaceClient(object):
         current_year = str(date.today().year)
         try:
             query = json.dumps({"query": {"field": "four_part_id", "value": current_year, "jsonmodel_type": "field_query"}})
-            r = self.client.get("repositories/{}/search".format(self.repo_id), params={"page": 1, "type[]": "accession", "sort": "identifier desc", "aq": query}).json()
+            r = self.request("get", "repositories/{}/search".format(self.repo_id), params={"page": 1, "type[]": "accession", "sort": "identifier desc", "aq": query}).json()
             number = "1"
             if r.get("total_hits") >= 1:
                 if r["results"][0]["identifier"].split("-")[0] == current_year:
@@ -104,8 +207,9 @@ class ArchivesSpaceClient(object):
 class UrsaMajorClient(object):
     """Client to get and receive data from Ursa Major."""
 
-    def __init__(self, baseurl):
+    def __init__(self, baseurl, pool_size=10, max_retries=3, timeout=None):
         self.client = ElectronBond(baseurl=baseurl)
+        configure_session(self.client.session, pool_size, max_retries, timeout)
 
     def send_request(self, method, url, data=None, **kwargs):
         """Base class for sending requests to Ursa Major"""
@@ -143,14 +247,81 @@ class UrsaMajorClient(object):
 class AuroraClient:
     """Client to update data in Aurora."""
 
-    def __init__(self, baseurl, username, password):
+    def __init__(self, baseurl, username, password, pool_size=10, max_retries=3, timeout=None):
         self.client = ElectronBond(baseurl=baseurl, username=username, password=password)
+        configure_session(self.client.session, pool_size, max_retries, timeout)
         if not self.client.authorize():
             raise AuroraClientError("Could not authorize {} in Aurora".format(username))
 
     def update(self, url, data, **kwargs):
         resp = self.client.put(url, data=json.dumps(data), headers={"Content-Type": "application/json"}, **kwargs)
+        if resp.status_code == 401:
+            # The token has expired, so log in again.
+            self.client.authorize()
+            resp = self.client.put(url, data=json.dumps(data), headers={"Content-Type": "application/json"}, **kwargs)
         if resp.status_code == 200:
             return resp.json()
         else:
             raise AuroraClientError("Error sending request {} to Aurora: {}".format(url, resp.json()))
+
+
+class AsyncClient(object):
+    """Base class for clients whose methods can be awaited.
+
+    Methods of the wrapped client are run in an executor, so that independent
+    requests can be made concurrently with `asyncio.gather` while sharing the
+    wrapped client's session and connection pool.
+    """
+
+    def __init__(self, client, executor=None):
+        self.client = client
+        self.executor = executor
+
+    async def call(self, method, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, partial(getattr(self.client, method), *args, **kwargs))
+
+
+class AsyncArchivesSpaceClient(AsyncClient):
+    """Awaitable client to get and receive data from ArchivesSpace."""
+
+    async def retrieve(self, url, **kwargs):
+        return await self.call("retrieve", url, **kwargs)
+
+    async def create(self, data, type, **kwargs):
+        return await self.call("create", data, type, **kwargs)
+
+    async def update(self, uri, data, **kwargs):
+        return await self.call("update", uri, data, **kwargs)
+
+    async def get_or_create(self, type, field, value, last_updated, consumer_data):
+        return await self.call("get_or_create", type, field, value, last_updated, consumer_data)
+
+    async def next_accession_number(self):
+        return await self.call("next_accession_number")
+
+
+class AsyncUrsaMajorClient(AsyncClient):
+    """Awaitable client to get and receive data from Ursa Major."""
+
+    async def retrieve(self, url, *args, **kwargs):
+        return await self.call("retrieve", url, *args, **kwargs)
+
+    async def update(self, url, data, **kwargs):
+        return await self.call("update", url, data, **kwargs)
+
+    async def retrieve_paged(self, url, **kwargs):
+        """Returns a list rather than a generator, since every page is fetched
+        in the executor."""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, lambda: list(self.client.retrieve_paged(url, **kwargs)))
+
+    async def find_bag_by_id(self, identifier, **kwargs):
+        return await self.call("find_bag_by_id", identifier, **kwargs)
+
+
+class AsyncAuroraClient(AsyncClient):
+    """Awaitable client to update data in Aurora."""
+
+    async def update(self, url, data, **kwargs):
+        return await self.call("update", url, data, **kwargs)
@@ -0,0 +1,406 @@
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from copy import deepcopy
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+from aquarius import settings
+
+from .benchmarks import load_responses
+from .cache import agent_cache
+from .clients import shared_clients
+from .models import Package
+from .routines import Pipeline
+
+ARCHIVESSPACE_COLLECTIONS = {
+    "people": "agent_person",
+    "corporate_entities": "agent_corporate_entity",
+    "families": "agent_family",
+    "accessions": "accession",
+    "archival_objects": "archival_object",
+    "digital_objects": "digital_object",
+}
+
+
+def percentile(values, fraction):
+    """Returns the value below which `fraction` of sorted `values` fall."""
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.respond("GET")
+
+    def do_POST(self):
+        self.respond("POST")
+
+    def do_PUT(self):
+        self.respond("PUT")
+
+    def respond(self, method):
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        status, data = self.server.service.dispatch(method, url.path, parse_qs(url.query), body)
+        payload = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubService(object):
+    """Emulates a web service on a local port.
+
+    Every request is delayed by `latency` seconds, and a fraction of requests
+    given by `error_rate` fail with a 503 response. Requests for paths added
+    to `missing` fail with a 404 response, and the number of following
+    requests given by `expired` fail with `expired_status`, as if the session
+    had expired. Requests are counted and timed by endpoint. Subclasses
+    implement `handle`, which returns a status code and JSON data for a
+    request.
+    """
+
+    expired_status = 401
+
+    def __init__(self, latency=0, error_rate=0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.missing = set()
+        self.expired = 0
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = defaultdict(list)
+        self.server = StubServer(("127.0.0.1", 0), StubRequestHandler)
+        self.server.service = self
+
+    @property
+    def baseurl(self):
+        return "http://{}:{}/".format(*self.server.server_address)
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def dispatch(self, method, path, query, body):
+        start = time.time()
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            failed = self.error_rate and not self.is_login(path) and self.random.random() < self.error_rate
+            expired = self.expired and not self.is_login(path)
+            if expired:
+                self.expired -= 1
+        if failed:
+            status, data = 503, {"error": {"status": ["Service unavailable"]}}
+        elif expired:
+            status, data = self.expired_status, {"error": {"session": ["Session expired"]}}
+        elif path in self.missing:
+            status, data = 404, {"error": {"uri": ["Not found"]}}
+        else:
+            try:
+                status, data = self.handle(method, path, query, json.loads(body) if body.startswith(b"{") else None)
+            except Exception as e:
+                status, data = 500, {"error": {"status": [str(e)]}}
+        with self.lock:
+            self.requests[self.get_endpoint(method, path, query)].append((time.time() - start, status))
+        return status, data
+
+    def get_endpoint(self, method, path, query):
+        """Returns a name for an endpoint, with identifiers replaced."""
+        path = re.sub(r"/[0-9a-f-]*\d[0-9a-f-]*(?=/|$)", "/{id}", path)
+        return "{} {}{}".format(method, path, "?" + ",".join(sorted(query)) if query else "")
+
+    def is_login(self, path):
+        return False
+
+    def handle(self, method, path, query, data):
+        raise NotImplementedError
+
+
+class ArchivesSpaceStub(StubService):
+    """Emulates the ArchivesSpace endpoints used by ArchivesSpaceClient.
+
+    Objects are only returned by searches `index_lag` seconds after they are
+    created. Accession identifiers must be unique, and updates must include
+    the current lock_version of an object.
+    """
+
+    expired_status = 412
+
+    def __init__(self, index_lag=0, **kwargs):
+        super(ArchivesSpaceStub, self).__init__(**kwargs)
+        self.index_lag = index_lag
+        # The number of following updates which fail as if the object had
+        # been modified by another request.
+        self.conflicts = 0
+        self.objects = OrderedDict()
+        self.created = {}
+        self.last_id = 0
+
+    def is_login(self, path):
+        return path.endswith("/login")
+
+    def handle(self, method, path, query, data):
+        if self.is_login(path):
+            return 200, {"session": "session"}
+        if path.endswith("/search"):
+            return self.search(query)
+        collection = path.rstrip("/").split("/")[-1]
+        with self.lock:
+            if method == "GET" and collection in ARCHIVESSPACE_COLLECTIONS:
+                return self.list(path, query)
+            if method == "POST" and collection in ARCHIVESSPACE_COLLECTIONS:
+                return self.create(path, ARCHIVESSPACE_COLLECTIONS[collection], data)
+            if path not in self.objects:
+                return 404, {"error": {"uri": ["Record not found"]}}
+            if method == "GET":
+                return 200, self.objects[path]
+            return self.update(path, data)
+
+    def create(self, path, model_type, data):
+        if model_type == "accession":
+            identifier = "{}-{}".format(data["id_0"], data["id_1"])
+            if any(obj.get("identifier") == identifier for obj in self.objects.values()):
+                return 400, {"error": {"id_0": ["That ID is already in use"]}}
+            data["identifier"] = identifier
+        if model_type.startswith("agent_"):
+            name = data["names"][0]
+            data["title"] = (", ".join([name["primary_name"], name["rest_of_name"]]) if name.get("rest_of_name")
+                             else name.get("primary_name", name.get("family_name")))
+        self.last_id += 1
+        uri = "{}/{}".format(path.rstrip("/"), self.last_id)
+        data.update(uri=uri, jsonmodel_type=model_type, lock_version=0)
+        data.setdefault("instances", [])
+        self.objects[uri] = data
+        self.created[uri] = time.time()
+        return 200, {"status": "Created", "id": self.last_id, "uri": uri, "lock_version": 0}
+
+    def update(self, uri, data):
+        if self.conflicts:
+            self.conflicts -= 1
+            self.objects[uri]["lock_version"] += 1
+        if data.get("lock_version") != self.objects[uri]["lock_version"]:
+            return 409, {"error": {"lock_version": ["The record was modified by another request"]}}
+        data["lock_version"] += 1
+        self.objects[uri] = data
+        return 200, {"status": "Updated", "uri": uri, "lock_version": data["lock_version"]}
+
+    def list(self, path, query):
+        objects = [obj for uri, obj in self.objects.items() if uri.rsplit("/", 1)[0] == path.rstrip("/")]
+        if "all_ids" in query:
+            return 200, [int(obj["uri"].split("/")[-1]) for obj in objects]
+        ids = query.get("id_set[]", [])
+        return 200, [obj for obj in objects if obj["uri"].split("/")[-1] in ids]
+
+    def search(self, query):
+        aq = json.loads(query["aq"][0])["query"]
+        indexed_before = time.time() - self.index_lag
+        with self.lock:
+            results = [obj for uri, obj in self.objects.items()
+                       if obj["jsonmodel_type"] == query["type[]"][0] and self.created[uri] <= indexed_before]
+        if aq["field"] == "four_part_id":
+            results = sorted([obj for obj in results if obj["identifier"].startswith(aq["value"])],
+                             key=lambda obj: obj["identifier"], reverse=True)
+        else:
+            results = [obj for obj in results if obj.get(aq["field"]) == aq["value"]]
+        return 200, {"total_hits": len(results), "results": [
+            {"uri": obj["uri"], "title": obj.get("title"), "identifier": obj.get("identifier")}
+            for obj in results[:10]]}
+
+
+class UrsaMajorStub(StubService):
+    """Emulates the Ursa Major endpoints used by UrsaMajorClient."""
+
+    page_size = 100
+
+    def __init__(self, **kwargs):
+        super(UrsaMajorStub, self).__init__(**kwargs)
+        self.bags = OrderedDict()
+        self.accessions = {}
+
+    def handle(self, method, path, query, data):
+        if path == "/bags/":
+            bags = list(self.bags.values())
+            if "id" in query:
+                bags = [bag for bag in bags if bag["bag_identifier"] == query["id"][0]]
+            page = int(query.get("page", [1])[0])
+            results = bags[(page - 1) * self.page_size:page * self.page_size]
+            return 200, {
+                "count": len(bags),
+                "next": "{}bags/?page={}".format(self.baseurl, page + 1) if page * self.page_size < len(bags) else None,
+                "results": [{"url": bag["url"], "bag_identifier": bag["bag_identifier"]} for bag in results]}
+        obj = self.bags.get(path) or self.accessions.get(path)
+        if not obj:
+            return 404, {"detail": "Not found."}
+        return 200, obj
+
+
+class AuroraStub(StubService):
+    """Emulates the Aurora endpoints used by AuroraClient."""
+
+    def is_login(self, path):
+        return path == "/get-token/"
+
+    def handle(self, method, path, query, data):
+        if self.is_login(path):
+            return 200, {"token": "token"}
+        return 200, data
+
+
+class LoadTest(object):
+    """Runs every routine against stub ArchivesSpace, Ursa Major and Aurora
+    services, with a generated set of packages.
+
+    Each generated bag has an AIP and a DIP package, and bags are grouped into
+    accessions of `transfers_per_accession` bags. Creators are drawn from a
+    pool of `agents` names, so agents are shared between accessions.
+
+    Routines are run in the current database, so the caller is responsible
+    for using a test database.
+    """
+
+    def __init__(self, packages=10000, transfers_per_accession=4, agents=100, latency=0,
+                 error_rate=0, index_lag=0, pipeline=False, seed=0):
+        self.packages = packages
+        self.transfers_per_accession = transfers_per_accession
+        self.agents = agents
+        self.pipeline = pipeline
+        self.random = random.Random(seed)
+        service_options = {"latency": latency, "error_rate": error_rate, "seed": seed}
+        self.archivesspace = ArchivesSpaceStub(index_lag=index_lag, **service_options)
+        self.ursa_major = UrsaMajorStub(**service_options)
+        self.aurora = AuroraStub(**service_options)
+        self.services = OrderedDict((
+            ("ArchivesSpace", self.archivesspace), ("Ursa Major", self.ursa_major), ("Aurora", self.aurora)))
+
+    def run(self):
+        """Seeds packages, runs the routines and returns a report."""
+        self.start()
+        try:
+            self.seed()
+            return {"routines": self.run_routines(), "endpoints": self.get_endpoint_stats()}
+        finally:
+            self.stop()
+
+    def start(self):
+        for service in self.services.values():
+            service.start()
+        self.original_settings = {
+            key: getattr(settings, key) for key in ("ARCHIVESSPACE", "URSA_MAJOR", "AURORA", "ISOLATE_FAILURES")}
+        settings.ARCHIVESSPACE = dict(settings.ARCHIVESSPACE, baseurl=self.archivesspace.baseurl)
+        settings.URSA_MAJOR = dict(settings.URSA_MAJOR, baseurl=self.ursa_major.baseurl)
+        settings.AURORA = dict(settings.AURORA, baseurl=self.aurora.baseurl)
+        settings.ISOLATE_FAILURES = True
+        shared_clients.clear()
+        agent_cache.invalidate()
+
+    def stop(self):
+        for key, value in self.original_settings.items():
+            setattr(settings, key, value)
+        shared_clients.clear()
+        agent_cache.invalidate()
+        for service in self.services.values():
+            service.stop()
+
+    def get_agent(self, index):
+        number = index % self.agents
+        if number % 2:
+            return {"name": "Organization {}".format(number), "type": "organization"}
+        return {"name": "Surname{}, Forename".format(number), "type": "person"}
+
+    def seed(self):
+        """Adds bags and accessions to the Ursa Major stub and creates a
+        package for each AIP and DIP."""
+        bag_templates, accession_templates = load_responses()
+        packages = []
+        accession = None
+        for number in range(1, max(self.packages // 2, 1) + 1):
+            if (number - 1) % self.transfers_per_accession == 0:
+                accession = self.add_accession(accession_templates[0], len(self.ursa_major.accessions) + 1)
+            identifier = str(uuid.UUID(int=self.random.getrandbits(128)))
+            bag = deepcopy(bag_templates[0])
+            bag.update(url="{}bags/{}/".format(self.ursa_major.baseurl, number), bag_identifier=identifier,
+                       accession=accession["url"])
+            bag["data"].update(url="/api/transfers/{}/".format(number), identifier=identifier)
+            bag["data"]["metadata"]["record_creators"] = [self.get_agent(number)]
+            self.ursa_major.bags["/bags/{}/".format(number)] = bag
+            accession["data"]["transfers"].append(
+                {"url": "/api/transfers/{}/".format(number), "identifier": identifier})
+            for package_type in ("aip", "dip"):
+                packages.append(Package(
+                    fedora_uri="http://fedora/rest/{}-{}".format(identifier, package_type),
+                    bag_identifier=identifier, type=package_type, origin="aurora",
+                    process_status=Package.SAVED))
+        Package.objects.bulk_create(packages, batch_size=1000)
+
+    def add_accession(self, template, number):
+        accession = deepcopy(template)
+        accession["url"] = "{}accessions/{}/".format(self.ursa_major.baseurl, number)
+        accession["data"].update(
+            url="/api/accessions/{}/".format(number), title="Load test accession {}".format(number),
+            creators=[self.get_agent(number)], transfers=[])
+        self.ursa_major.accessions["/accessions/{}/".format(number)] = accession
+        return accession
+
+    def run_routines(self):
+        """Runs each routine, or the pipeline, and times it."""
+        routines = [Pipeline] if self.pipeline else (
+            Pipeline.async_stages if settings.ASYNC_ROUTINES else Pipeline.stages)
+        results = OrderedDict()
+        for routine in routines:
+            start = time.time()
+            try:
+                message, objects = routine().run()
+                error = None
+            except Exception as e:
+                objects, error = {}, str(e)
+            seconds = time.time() - start
+            if self.pipeline:
+                succeeded = sum(len(result["succeeded"]) for result in objects.values())
+                failed = sum(len(result["failed"]) for result in objects.values())
+            else:
+                succeeded = len(objects.get("succeeded", []))
+                failed = len(objects.get("failed", []))
+            results[routine.__name__] = {
+                "succeeded": succeeded, "failed": failed, "seconds": seconds,
+                "per_second": succeeded / seconds if seconds else 0, "error": error}
+        completed = Package.objects.filter(process_status=Package.UPDATE_SENT).count()
+        seconds = sum(result["seconds"] for result in results.values())
+        results["Total"] = {
+            "succeeded": completed, "failed": Package.objects.count() - completed, "seconds": seconds,
+            "per_second": completed / seconds if seconds else 0, "error": None}
+        return results
+
+    def get_endpoint_stats(self):
+        """Returns request counts, errors and latency percentiles in seconds
+        for each endpoint of each service."""
+        stats = OrderedDict()
+        for name, service in self.services.items():
+            for endpoint, requests in sorted(service.requests.items()):
+                latencies = sorted(seconds for seconds, status in requests)
+                stats["{} {}".format(name, endpoint)] = {
+                    "requests": len(requests),
+                    "errors": len([status for seconds, status in requests if status >= 400]),
+                    "p50": percentile(latencies, 0.5),
+                    "p90": percentile(latencies, 0.9),
+                    "p99": percentile(latencies, 0.99)}
+        return stats
@@ -0,0 +1,43 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from transformer.benchmarks import run_benchmarks
+
+
+class Command(BaseCommand):
+    help = ("Measures the throughput and memory use of each mapping on large inputs generated "
+            "from the data recorded in the test cassettes.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scale", type=int, default=50,
+                            help="Number of rights statements, acts, creators and agents in generated inputs.")
+        parser.add_argument("--number", type=int, default=20, help="Number of times to apply each mapping.")
+        parser.add_argument("--save", help="Save results as JSON to this file.")
+        parser.add_argument("--compare", help="Compare results with results saved by --save.")
+        parser.add_argument("--threshold", type=float, default=20,
+                            help="Percentage slowdown compared to saved results which is treated as a regression.")
+
+    def handle(self, *args, **options):
+        results = run_benchmarks(options["scale"], options["number"])
+        baseline = {}
+        if options["compare"]:
+            with open(options["compare"], "r") as f:
+                baseline = json.load(f)
+        self.stdout.write("{:<34} {:>10} {:>10} {:>10} {:>10} {:>9}".format(
+            "Mapping", "Input KiB", "Per second", "Peak KiB", "Blocks", "Slowdown"))
+        regressions = []
+        for name, result in results.items():
+            change = ""
+            if name in baseline:
+                percent = (baseline[name]["per_second"] / result["per_second"] - 1) * 100
+                change = "{:+.1f}%".format(percent)
+                if percent > options["threshold"]:
+                    regressions.append(name)
+            self.stdout.write("{:<34} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.0f} {:>9}".format(
+                name, result["input_bytes"] / 1024, result["per_second"], result["peak_bytes"] / 1024,
+                result["blocks"], change))
+        if options["save"]:
+            with open(options["save"], "w") as f:
+                json.dump(results, f, indent=2)
+        if regressions:
+            raise CommandError("Slower than saved results: {}".format(", ".join(regressions)))
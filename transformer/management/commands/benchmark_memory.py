@@ -0,0 +1,20 @@
+from aquarius import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from transformer.benchmarks import create_backlog, measure_backlog_memory
+
+
+class Command(BaseCommand):
+    help = "Measures the peak memory used to load backlogs of packages in claimed batches, and all at once."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--backlogs", type=int, nargs="+", default=[1000, 4000, 16000], help="Numbers of pending packages.")
+        parser.add_argument("--batch-size", type=int, default=settings.CLAIM_BATCH_SIZE, help="Number of packages claimed at a time.")
+
+    def handle(self, *args, **options):
+        self.stdout.write("{:>10} {:>14} {:>16}".format("Backlog", "Batched (KB)", "All at once (KB)"))
+        for backlog in options["backlogs"]:
+            with transaction.atomic():
+                batched, all_at_once = measure_backlog_memory(create_backlog(backlog), options["batch_size"])
+                self.stdout.write("{:>10} {:>14.0f} {:>16.0f}".format(backlog, batched / 1024, all_at_once / 1024))
+                transaction.set_rollback(True)
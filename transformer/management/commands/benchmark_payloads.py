@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from transformer.benchmarks import (compare_selected_bytes,
+                                    create_sample_packages)
+
+
+class Command(BaseCommand):
+    help = "Compares the bytes of package data selected by each routine with and without deferring unused JSON fields."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--packages", type=int, default=1000, help="Number of packages to generate for each routine.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            packages = create_sample_packages(options["packages"])
+            self.stdout.write("{:<28} {:>14} {:>14} {:>10}".format("Query", "All fields", "Selected", "Reduction"))
+            for name, full, selected in compare_selected_bytes(packages):
+                self.stdout.write("{:<28} {:>14} {:>14} {:>9.1f}%".format(
+                    name, full, selected, 100 * (1 - selected / full) if full else 0))
+            transaction.set_rollback(True)
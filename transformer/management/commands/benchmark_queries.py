@@ -0,0 +1,58 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from transformer.models import Package
+
+INSERT_PACKAGES = """
+    INSERT INTO transformer_package (
+        fedora_uri, bag_identifier, type, origin, process_status, data,
+        accession_data, created, last_modified, attempt_count)
+    SELECT
+        'http://fedora/rest/' || i,
+        'bag-' || (i / 2),
+        CASE WHEN i %% 2 = 0 THEN 'aip' ELSE 'dip' END,
+        CASE WHEN i %% 10 = 0 THEN 'digitization' ELSE 'aurora' END,
+        CASE WHEN i %% 1000 = 0 THEN %s ELSE %s END,
+        jsonb_build_object('accession', 'http://ursa-major/accessions/' || (i / 20) || '/', 'data', '{}'::jsonb),
+        CASE WHEN i %% 3 = 0 THEN '{"data": {}}'::jsonb ELSE NULL END,
+        now(), now() - i * interval '1 second', 0
+    FROM generate_series(1, %s) AS i
+"""
+
+
+class Command(BaseCommand):
+    help = "Prints query plans for the queries made by routines against a table of generated packages."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1000000, help="Number of packages to generate.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(INSERT_PACKAGES, [Package.SAVED, Package.UPDATE_SENT, options["rows"]])
+                cursor.execute("ANALYZE transformer_package")
+            for name, queryset in self.get_querysets():
+                sql, params = queryset.query.sql_with_params()
+                with connection.cursor() as cursor:
+                    cursor.execute("EXPLAIN ANALYZE {}".format(sql), params)
+                    self.stdout.write("{}\n{}\n".format(name, "\n".join(row[0] for row in cursor.fetchall())))
+            transaction.set_rollback(True)
+
+    def get_querysets(self):
+        position = timezone.now() - timedelta(seconds=500000)
+        return [
+            ("Routine packages", Package.objects.filter(process_status=Package.SAVED)),
+            ("Aurora updater packages", Package.objects.filter(process_status=Package.SAVED, origin="aurora")),
+            ("Sibling packages", Package.objects.filter(bag_identifier="bag-500")),
+            ("Sibling accession data", Package.objects.filter(
+                data__accession="http://ursa-major/accessions/50/", accession_data__isnull=False)[:1]),
+            ("Related packages by accession", Package.objects.filter(
+                data__accession__in=["http://ursa-major/accessions/50/", "http://ursa-major/accessions/51/"])),
+            ("Package list page by offset", Package.objects.order_by("-last_modified", "-id")[500000:500025]),
+            ("Package list page by cursor", Package.objects.filter(
+                Q(last_modified__lte=position), Q(last_modified__lt=position) | Q(id__lt=500000)
+            ).order_by("-last_modified", "-id")[:26]),
+        ]
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from transformer.benchmarks import compare_transforms, get_samples
+
+
+class Command(BaseCommand):
+    help = "Compares the time taken to transform data recorded in the test cassettes with and without encoding to JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--number", type=int, default=1000, help="Number of times to apply each mapping.")
+
+    def handle(self, *args, **options):
+        self.stdout.write("{:<20} {:>12} {:>12} {:>8} {:>10}".format(
+            "Mapping", "JSON (us)", "Dict (us)", "Speedup", "Identical"))
+        for name, json_time, dict_time, identical in compare_transforms(get_samples(), options["number"]):
+            self.stdout.write("{:<20} {:>12.1f} {:>12.1f} {:>7.2f}x {:>10}".format(
+                name, json_time * 1e6, dict_time * 1e6, json_time / dict_time, "yes" if identical else "NO"))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from transformer.cache import agent_cache
+
+
+class Command(BaseCommand):
+    help = "Removes cached ArchivesSpace agent URIs."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--type", help="Agent type (person, organization or family).")
+        parser.add_argument("--name", help="Agent name.")
+
+    def handle(self, *args, **options):
+        agent_cache.invalidate(options["type"], options["name"])
+        self.stdout.write("Agent cache invalidated. Other processes stop using removed agents within {} seconds.".format(
+            agent_cache.local_ttl))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.test.utils import setup_databases, teardown_databases
+from transformer.loadtest import LoadTest
+
+
+class Command(BaseCommand):
+    help = "Runs every routine against stub ArchivesSpace, Ursa Major and Aurora servers, in a test database."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--packages", type=int, default=10000, help="Number of packages to generate.")
+        parser.add_argument("--transfers-per-accession", type=int, default=4, help="Number of transfers in each accession.")
+        parser.add_argument("--agents", type=int, default=100, help="Number of distinct creators.")
+        parser.add_argument("--latency", type=float, default=0, help="Milliseconds added to each response.")
+        parser.add_argument("--error-rate", type=float, default=0, help="Fraction of requests which fail with a 503 response.")
+        parser.add_argument("--index-lag", type=float, default=0, help="Seconds before created objects appear in ArchivesSpace searches.")
+        parser.add_argument("--pipeline", action="store_true", help="Run the pipeline rather than each routine in turn.")
+        parser.add_argument("--seed", type=int, default=0, help="Seed for generated identifiers and errors.")
+
+    def handle(self, *args, **options):
+        load_test = LoadTest(
+            packages=options["packages"], transfers_per_accession=options["transfers_per_accession"],
+            agents=options["agents"], latency=options["latency"] / 1000, error_rate=options["error_rate"],
+            index_lag=options["index_lag"], pipeline=options["pipeline"], seed=options["seed"])
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            report = load_test.run()
+        finally:
+            teardown_databases(old_config, verbosity=0)
+        self.stdout.write("{:<32} {:>10} {:>8} {:>10} {:>12}".format(
+            "Routine", "Succeeded", "Failed", "Seconds", "Packages/s"))
+        for name, result in report["routines"].items():
+            self.stdout.write("{:<32} {:>10} {:>8} {:>10.1f} {:>12.1f}".format(
+                name, result["succeeded"], result["failed"], result["seconds"], result["per_second"]))
+            if result["error"]:
+                self.stderr.write("  {}".format(result["error"]))
+        self.stdout.write("\n{:<72} {:>9} {:>7} {:>9} {:>9} {:>9}".format(
+            "Endpoint", "Requests", "Errors", "p50 (ms)", "p90 (ms)", "p99 (ms)"))
+        for name, stats in report["endpoints"].items():
+            self.stdout.write("{:<72} {:>9} {:>7} {:>9.1f} {:>9.1f} {:>9.1f}".format(
+                name, stats["requests"], stats["errors"], stats["p50"] * 1000, stats["p90"] * 1000,
+                stats["p99"] * 1000))
@@ -0,0 +1,32 @@
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from transformer.models import Job
+from transformer.routines import run_job
+
+
+class Command(BaseCommand):
+    help = "Runs queued routine jobs. Several workers can be run at once."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=5,
+                            help="Seconds to wait before checking for new jobs when the queue is empty.")
+        parser.add_argument("--once", action="store_true",
+                            help="Exit when the queue is empty instead of waiting for new jobs.")
+
+    def handle(self, *args, **options):
+        worker = "{}:{}".format(socket.gethostname(), os.getpid())[-64:]
+        while True:
+            job = Job.objects.claim_next(worker)
+            if not job:
+                if options["once"]:
+                    break
+                close_old_connections()
+                time.sleep(options["interval"])
+                continue
+            self.stdout.write("Running {} job {}".format(job.routine, job.pk))
+            run_job(job)
+            self.stdout.write("Job {} {}".format(job.pk, job.get_status_display().lower()))
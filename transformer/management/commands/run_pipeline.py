@@ -0,0 +1,13 @@
+import json
+
+from django.core.management.base import BaseCommand
+from transformer.routines import Pipeline
+
+
+class Command(BaseCommand):
+    help = "Advances pending packages through every routine in one pass."
+
+    def handle(self, *args, **options):
+        message, results = Pipeline().run()
+        self.stdout.write(message)
+        self.stdout.write(json.dumps(results, indent=2))
@@ -1,4 +1,11 @@
+from collections.abc import KeysView, ValuesView
+
 import odin
+from odin.adapters import ResourceAdapter
+from odin.bases import ResourceIterable
+from odin.codecs import dict_codec, json_codec
+from odin.resources import ResourceBase
+from odin.utils import getmeta
 
 from .resources.archivesspace import (ArchivesSpaceAccession,
                                       ArchivesSpaceAgentCorporateEntity,
@@ -326,3 +333,39 @@ class SourcePackageToDigitalObject(odin.Mapping):
     @odin.map_field(from_field=("fedora_uri", "use_statement"), to_field="file_versions", to_list=True)
     def file_versions(self, fedora_uri, use_statement):
         return [ArchivesSpaceFileVersion(file_uri=fedora_uri, use_statement=use_statement)]
+
+
+SCALAR_TYPES = {str, int, float, bool, type(None)}
+LIST_TYPES = (list, tuple, KeysView, ValuesView, ResourceIterable)
+
+
+def dump_resource(value):
+    """Returns a resource as a dict containing only JSON types.
+
+    Produces the same result as parsing the output of the JSON codec, but
+    checks the type of each value directly rather than encoding to and
+    parsing JSON.
+    """
+    if value.__class__ in SCALAR_TYPES:
+        return value
+    if isinstance(value, LIST_TYPES):
+        return [dump_resource(v) for v in value]
+    if isinstance(value, dict):
+        return {k: dump_resource(v) for k, v in value.items()}
+    if isinstance(value, (ResourceBase, ResourceAdapter)):
+        meta = getmeta(value)
+        obj = {k: dump_resource(v) for k, v in value.to_dict(True).items()}
+        obj[meta.type_field] = meta.resource_name
+        return obj
+    if value.__class__ in json_codec.JSON_TYPES:
+        return json_codec.JSON_TYPES[value.__class__](value)
+    return value
+
+
+def transform(data, from_resource, mapping):
+    """Applies a mapping to a dict, and returns the result as a dict.
+
+    The result is identical to loading `data` with the JSON codec and parsing
+    the mapped resource dumped by the JSON codec.
+    """
+    return dump_resource(mapping.apply(dict_codec.load(data, from_resource)))
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.10 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transformer', '0010_auto_20200317_0147'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='package',
+            name='attempt_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='package',
+            name='error_message',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='package',
+            name='next_attempt',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
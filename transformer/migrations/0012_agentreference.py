@@ -0,0 +1,26 @@
+# Generated by Django 2.2.10 on 2026-10-18 12:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transformer', '0011_auto_20261018_1200'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AgentReference',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('agent_type', models.CharField(max_length=50)),
+                ('name', models.CharField(max_length=255)),
+                ('uri', models.CharField(max_length=255)),
+                ('last_modified', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('agent_type', 'name')},
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.10 on 2026-10-18 13:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transformer', '0012_agentreference'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccessionNumberSequence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveIntegerField(unique=True)),
+                ('last_number', models.PositiveIntegerField()),
+            ],
+        ),
+    ]
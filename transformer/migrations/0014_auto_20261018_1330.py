@@ -0,0 +1,28 @@
+# Generated by Django 2.2.10 on 2026-10-18 13:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transformer', '0013_accessionnumbersequence'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='package',
+            index=models.Index(fields=['process_status', 'origin'], name='package_status_origin_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='package',
+            index=models.Index(fields=['bag_identifier'], name='package_bag_identifier_idx'),
+        ),
+        # Supports `data__accession=...` lookups with `accession_data__isnull=False`,
+        # which Django compiles to `(data -> 'accession') = ...`.
+        migrations.RunSQL(
+            "CREATE INDEX package_accession_idx ON transformer_package ((data -> 'accession')) "
+            "WHERE accession_data IS NOT NULL;",
+            "DROP INDEX package_accession_idx;",
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.10 on 2026-10-18 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transformer', '0014_auto_20261018_1330'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='package',
+            name='claimed_by',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='package',
+            name='claimed_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
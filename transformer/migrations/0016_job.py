@@ -0,0 +1,30 @@
+# Generated by Django 2.2.10 on 2026-10-18 14:30
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transformer', '0015_auto_20261018_1400'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('routine', models.CharField(max_length=100)),
+                ('status', models.PositiveSmallIntegerField(choices=[(10, 'Queued'), (20, 'Running'), (30, 'Succeeded'), (40, 'Failed')], default=10)),
+                ('worker', models.CharField(blank=True, max_length=64, null=True)),
+                ('processed', models.PositiveIntegerField(default=0)),
+                ('failed', models.PositiveIntegerField(default=0)),
+                ('result', django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
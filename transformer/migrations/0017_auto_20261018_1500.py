@@ -0,0 +1,17 @@
+# Generated by Django 2.2.10 on 2026-10-18 15:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transformer', '0016_job'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='package',
+            index=models.Index(fields=['last_modified', 'id'], name='package_modified_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 2.2.10 on 2026-10-18 15:30
+
+from django.db import migrations, models
+from django.db.models import Count
+
+# Process statuses in the order packages reach them. Status codes are not in
+# pipeline order: accession updates are sent after accessions are created,
+# before any archival objects are.
+PIPELINE_ORDER = (10, 20, 70, 30, 40, 50, 60)
+
+
+def get_rank(package):
+    """Ranks a package by how far it has moved through the pipeline, and then
+    by the number of ArchivesSpace URIs saved on it."""
+    data = (package.data or {}).get('data') or {}
+    accession_data = (package.accession_data or {}).get('data') or {}
+    uris = [data.get('archivesspace_parent_identifier'), data.get('archivesspace_identifier'),
+            accession_data.get('archivesspace_identifier')]
+    status = int(package.process_status)
+    stage = PIPELINE_ORDER.index(status) if status in PIPELINE_ORDER else -1
+    return (stage, len([uri for uri in uris if uri]))
+
+
+def remove_duplicate_packages(apps, schema_editor):
+    """Keeps the most advanced of each set of duplicate packages, so that
+    objects already created in ArchivesSpace are not created again."""
+    Package = apps.get_model('transformer', 'Package')
+    duplicates = Package.objects.values('bag_identifier', 'type', 'fedora_uri').annotate(
+        count=Count('id')).filter(count__gt=1).order_by()
+    for duplicate in duplicates:
+        del duplicate['count']
+        packages = sorted(Package.objects.filter(**duplicate).order_by('pk'),
+                          key=get_rank, reverse=True)
+        Package.objects.filter(pk__in=[p.pk for p in packages[1:]]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transformer', '0017_auto_20261018_1500'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_packages, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='package',
+            constraint=models.UniqueConstraint(fields=('bag_identifier', 'type', 'fedora_uri'), name='package_unique_delivery'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.10 on 2026-10-18 16:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transformer', '0019_job_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='package',
+            name='digital_object_uri',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.10 on 2026-10-18 17:00
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transformer', '0020_package_digital_object_uri'),
+    ]
+
+    operations = [
+        # Removes the `accession_data IS NOT NULL` predicate, so that the index
+        # also supports `data__accession__in=...` lookups which do not filter
+        # on accession_data, such as those used to claim related packages.
+        migrations.RunSQL(
+            "DROP INDEX package_accession_idx;"
+            "CREATE INDEX package_accession_idx ON transformer_package ((data -> 'accession'));",
+            "DROP INDEX package_accession_idx;"
+            "CREATE INDEX package_accession_idx ON transformer_package ((data -> 'accession')) "
+            "WHERE accession_data IS NOT NULL;",
+        ),
+    ]
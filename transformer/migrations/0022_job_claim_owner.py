@@ -0,0 +1,18 @@
+# Generated by Django 2.2.10 on 2026-10-18 17:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transformer', '0021_auto_20261018_1700'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='claim_owner',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.10 on 2026-10-18 18:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transformer', '0022_job_claim_owner'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='agentreference',
+            name='name',
+            field=models.TextField(),
+        ),
+    ]
@@ -1,6 +1,195 @@
+import json
+from contextlib import contextmanager
+from datetime import timedelta
+
+from aquarius import settings
 from asterism.models import BasePackage
 from django.contrib.postgres.fields import JSONField
-from django.db import models
+from django.contrib.postgres.fields.jsonb import KeyTextTransform, KeyTransform
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import F, Func, Q, Value
+from django.utils import timezone
+
+
+def try_advisory_lock(key):
+    """Takes a session-level Postgres advisory lock on a string without
+    waiting, and returns whether it was taken."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(hashtext(%s))", [key])
+        return cursor.fetchone()[0]
+
+
+def advisory_unlock(key):
+    """Releases an advisory lock taken by this connection."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_unlock(hashtext(%s))", [key])
+
+
+@contextmanager
+def advisory_lock(key):
+    """Holds a session-level Postgres advisory lock on a string, waiting for
+    it if it is held by another connection.
+
+    Unlike row locks, the lock is held across transactions, so it can be held
+    while requests are made to other services.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(hashtext(%s))", [key])
+    try:
+        yield
+    finally:
+        advisory_unlock(key)
+
+
+class PackageQuerySet(models.QuerySet):
+    JSON_FIELDS = ('data', 'accession_data')
+
+    def eligible(self):
+        """Excludes packages which are waiting to be retried after an error, or
+        which are no longer retried."""
+        return self.exclude(next_attempt__gt=timezone.now()).exclude(
+            attempt_count__gte=settings.RETRY_MAX_ATTEMPTS)
+
+    def waiting(self):
+        """Returns packages which are waiting to be retried after an error."""
+        return self.filter(next_attempt__gt=timezone.now())
+
+    def abandoned(self):
+        """Returns packages which have failed `RETRY_MAX_ATTEMPTS` times, and
+        are no longer retried."""
+        return self.filter(attempt_count__gte=settings.RETRY_MAX_ATTEMPTS)
+
+    def claimable(self):
+        """Excludes packages claimed by a routine whose lease has not expired."""
+        return self.filter(Q(claimed_until__isnull=True) | Q(claimed_until__lte=timezone.now()))
+
+    def claim(self, owner, limit=None, lease=None):
+        """Claims up to `limit` unclaimed packages for `lease` seconds and
+        returns them.
+
+        Rows locked by another transaction are skipped rather than waited for,
+        so routines claiming packages at the same time receive different
+        packages. Claims which are not released expire after the lease, so
+        packages held by a process which stopped are picked up again.
+        """
+        lease = settings.CLAIM_LEASE if lease is None else lease
+        with transaction.atomic():
+            ids = list(self.claimable().select_for_update(skip_locked=True).order_by(
+                'pk').values_list('pk', flat=True)[:limit])
+            self.model.objects.filter(pk__in=ids).update(
+                claimed_by=owner, claimed_until=timezone.now() + timedelta(seconds=lease))
+        return self.filter(pk__in=ids, claimed_by=owner)
+
+    def with_json(self, *fields):
+        """Loads only the given JSON fields, deferring the others.
+
+        Deferred fields are loaded with an extra query if they are accessed,
+        and are not written when a package is saved.
+        """
+        return self.defer(*[f for f in self.JSON_FIELDS if f not in fields])
+
+    def annotate_json(self, **paths):
+        """Annotates each package with the text at a path in a JSON field,
+        so that a single value can be selected without loading the field. For
+        example, `transfer_uri=('data', 'data', 'archivesspace_identifier')`
+        selects `data->'data'->>'archivesspace_identifier'`.
+        """
+        annotations = {}
+        for name, path in paths.items():
+            expression = path[0]
+            for key in path[1:-1]:
+                expression = KeyTransform(key, expression)
+            annotations[name] = KeyTextTransform(path[-1], expression)
+        return self.annotate(**annotations)
+
+    def claim_batches(self, owner, size=None, claim_related=None):
+        """Claims packages in batches of up to `size`, in primary key order,
+        and yields each batch as a list, releasing it once it is processed.
+
+        Progress is kept as a cursor on the primary key rather than a list of
+        claimed packages, so memory use and query size stay the same however
+        many packages are pending. `claim_related`, if given, is called with
+        the queryset and each batch, and returns further claimed packages to
+        add to the batch. Related packages ahead of the cursor are excluded
+        from later batches.
+        """
+        size = size or settings.CLAIM_BATCH_SIZE
+        cursor = 0
+        ahead = set()
+        while True:
+            batch = list(self.filter(pk__gt=cursor).exclude(pk__in=ahead).claim(owner, size))
+            if not batch:
+                return
+            cursor = max(p.pk for p in batch)
+            if claim_related:
+                batch += claim_related(self, batch)
+            ahead = set(p.pk for p in batch if p.pk > cursor) | set(pk for pk in ahead if pk > cursor)
+            try:
+                yield batch
+            finally:
+                self.model.objects.filter(pk__in=[p.pk for p in batch]).release(owner)
+
+    def renew(self, owner, lease=None):
+        """Extends the lease on packages claimed by `owner` by `lease` seconds
+        from now."""
+        lease = settings.CLAIM_LEASE if lease is None else lease
+        return self.filter(claimed_by=owner).update(claimed_until=timezone.now() + timedelta(seconds=lease))
+
+    def release(self, owner):
+        """Releases packages claimed by `owner`."""
+        return self.filter(claimed_by=owner).update(claimed_by=None, claimed_until=None)
+
+    def ingest(self, package):
+        """Saves an unsaved package unless a package with the same
+        bag_identifier, type and fedora_uri exists, so that a delivery which
+        is retried does not create a duplicate package.
+
+        Returns the saved package and whether it was created.
+        """
+        lookup = {'bag_identifier': package.bag_identifier, 'type': package.type, 'fedora_uri': package.fedora_uri}
+        existing = self.filter(**lookup).first()
+        if existing:
+            return existing, False
+        try:
+            with transaction.atomic():
+                package.save(force_insert=True)
+            return package, True
+        except IntegrityError:
+            return self.get(**lookup), False
+
+    def bulk_ingest(self, packages, batch_size=None):
+        """Saves unsaved packages which do not match an existing package, or
+        an earlier package in the list, with one INSERT per `batch_size`
+        packages.
+
+        Existing packages are found with one query per batch. Packages saved by
+        another request in the meantime are skipped by the database. Returns a
+        list of whether each package was created.
+        """
+        batch_size = batch_size or len(packages) or 1
+        existing = set()
+        for i in range(0, len(packages), batch_size):
+            existing.update(self.filter(
+                bag_identifier__in=set(p.bag_identifier for p in packages[i:i + batch_size])
+            ).values_list('bag_identifier', 'type', 'fedora_uri'))
+        new_packages = []
+        created = []
+        for package in packages:
+            key = (package.bag_identifier, package.type, package.fedora_uri)
+            created.append(key not in existing)
+            if key not in existing:
+                existing.add(key)
+                new_packages.append(package)
+        self.bulk_create(new_packages, batch_size=batch_size, ignore_conflicts=True)
+        return created
+
+    def update_data(self, path, value):
+        """Sets a nested key in the `data` of every package with one UPDATE
+        statement, rather than loading and saving each package."""
+        return self.update(
+            data=Func(F('data'), Value('{{{}}}'.format(','.join(path))), Value(json.dumps(value)),
+                      function='jsonb_set', output_field=JSONField()),
+            last_modified=timezone.now())
 
 
 class Package(BasePackage):
@@ -22,7 +211,26 @@ class Package(BasePackage):
         (UPDATE_SENT, 'Updated transfer data sent to Aurora'),
         (ACCESSION_UPDATE_SENT, 'Updated Accession data sent to Aurora')
     )
+    DIGITAL_ORIGINS = ('digitization', 'legacy_digital')
     accession_data = JSONField(null=True, blank=True)
+    error_message = models.TextField(null=True, blank=True)
+    attempt_count = models.PositiveIntegerField(default=0)
+    next_attempt = models.DateTimeField(null=True, blank=True)
+    claimed_by = models.CharField(max_length=64, null=True, blank=True)
+    claimed_until = models.DateTimeField(null=True, blank=True)
+    digital_object_uri = models.CharField(max_length=255, null=True, blank=True)
+
+    objects = PackageQuerySet.as_manager()
+
+    class Meta(BasePackage.Meta):
+        indexes = [
+            models.Index(fields=['process_status', 'origin'], name='package_status_origin_idx'),
+            models.Index(fields=['bag_identifier'], name='package_bag_identifier_idx'),
+            models.Index(fields=['last_modified', 'id'], name='package_modified_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['bag_identifier', 'type', 'fedora_uri'], name='package_unique_delivery'),
+        ]
 
     def __str__(self):
         return '{} {}'.format(self.type, self.bag_identifier)
@@ -30,3 +238,164 @@ class Package(BasePackage):
     @property
     def use_statement(self):
         return 'master' if (self.type == 'aip') else 'service-edited'
+
+    def record_failure(self, message):
+        """Saves an error message and schedules the next attempt, backing off
+        exponentially with each failed attempt up to `RETRY_MAX_DELAY`.
+
+        No attempt is scheduled once a package has failed `RETRY_MAX_ATTEMPTS`
+        times.
+        """
+        self.error_message = message
+        self.attempt_count += 1
+        self.next_attempt = None
+        if self.attempt_count < settings.RETRY_MAX_ATTEMPTS:
+            self.next_attempt = timezone.now() + timedelta(seconds=min(
+                settings.RETRY_DELAY * 2 ** (self.attempt_count - 1), settings.RETRY_MAX_DELAY))
+        self.save(update_fields=['error_message', 'attempt_count', 'next_attempt'])
+
+    def clear_failure(self):
+        """Resets error information once a package has been processed."""
+        self.error_message = None
+        self.attempt_count = 0
+        self.next_attempt = None
+
+
+class AgentReference(models.Model):
+    """Caches the ArchivesSpace URI of an agent, keyed on agent type and
+    normalized name."""
+    agent_type = models.CharField(max_length=50)
+    name = models.TextField()
+    uri = models.CharField(max_length=255)
+    last_modified = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('agent_type', 'name')
+
+    def __str__(self):
+        return '{} {}'.format(self.agent_type, self.name)
+
+
+class AccessionNumberSequence(models.Model):
+    """Hands out accession numbers for a year without searching ArchivesSpace."""
+    year = models.PositiveIntegerField(unique=True)
+    last_number = models.PositiveIntegerField()
+
+    def __str__(self):
+        return '{} {}'.format(self.year, self.last_number)
+
+    @classmethod
+    def next_number(cls, year, seed):
+        """Atomically increments and returns the last number used in a year.
+
+        The sequence for a year is created the first time it is needed,
+        starting from the number returned by the `seed` callable.
+        """
+        with transaction.atomic():
+            sequence = cls.objects.select_for_update().filter(year=year).first()
+            if not sequence:
+                try:
+                    with transaction.atomic():
+                        sequence = cls.objects.create(year=year, last_number=seed())
+                except IntegrityError:
+                    sequence = cls.objects.select_for_update().get(year=year)
+            sequence.last_number += 1
+            sequence.save(update_fields=['last_number'])
+            return sequence.last_number
+
+
+class JobQuerySet(models.QuerySet):
+
+    def stale(self, lease=None):
+        """Returns running jobs whose worker has not sent a heartbeat for
+        `lease` seconds."""
+        lease = settings.JOB_LEASE if lease is None else lease
+        return self.filter(status=Job.RUNNING).filter(
+            Q(heartbeat__isnull=True) | Q(heartbeat__lt=timezone.now() - timedelta(seconds=lease)))
+
+    def requeue_stale(self, lease=None):
+        """Queues stale jobs again, and releases the packages claimed by their
+        routines, so that the jobs continue with those packages when they are
+        run again rather than waiting for the claims to expire."""
+        with transaction.atomic():
+            stale = list(self.stale(lease).select_for_update(skip_locked=True).values_list('pk', 'claim_owner'))
+            for pk, claim_owner in stale:
+                if claim_owner:
+                    Package.objects.release(claim_owner)
+            self.model.objects.filter(pk__in=[pk for pk, _ in stale]).update(
+                status=Job.QUEUED, worker=None, started=None, heartbeat=None, claim_owner=None)
+        return len(stale)
+
+    def claim_next(self, worker, lease=None):
+        """Marks the oldest queued job as running and returns it, or returns
+        None if there are no queued jobs.
+
+        Jobs locked by another worker are skipped, so several workers can
+        take jobs from the queue at the same time. Running jobs whose worker
+        has stopped sending heartbeats are queued again first, so that a job
+        is not left running by a worker which stopped.
+        """
+        with transaction.atomic():
+            self.requeue_stale(lease)
+            job = self.filter(status=Job.QUEUED).select_for_update(skip_locked=True).order_by('pk').first()
+            if job:
+                job.status = Job.RUNNING
+                job.worker = worker
+                job.started = job.heartbeat = timezone.now()
+                job.save(update_fields=['status', 'worker', 'started', 'heartbeat'])
+        return job
+
+
+class Job(models.Model):
+    """A request to run a routine, which is run by a worker process."""
+    QUEUED = 10
+    RUNNING = 20
+    SUCCEEDED = 30
+    FAILED = 40
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed')
+    )
+    routine = models.CharField(max_length=100)
+    status = models.PositiveSmallIntegerField(choices=STATUS_CHOICES, default=QUEUED)
+    worker = models.CharField(max_length=64, null=True, blank=True)
+    processed = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    result = JSONField(null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    heartbeat = models.DateTimeField(null=True, blank=True)
+    claim_owner = models.CharField(max_length=64, null=True, blank=True)
+
+    objects = JobQuerySet.as_manager()
+
+    def __str__(self):
+        return '{} {}'.format(self.routine, self.pk)
+
+    def record_progress(self, processed, failed):
+        """Saves the number of packages processed so far, and a heartbeat."""
+        self.processed = processed
+        self.failed = failed
+        self.heartbeat = timezone.now()
+        self.save(update_fields=['processed', 'failed', 'heartbeat'])
+
+    def set_claim_owner(self, claim_owner):
+        """Saves the owner of the packages claimed by the job's routine."""
+        self.claim_owner = claim_owner
+        self.save(update_fields=['claim_owner'])
+
+    def beat(self):
+        """Records that the worker running the job is still running."""
+        self.heartbeat = timezone.now()
+        Job.objects.filter(pk=self.pk).update(heartbeat=self.heartbeat)
+
+    def finish(self, status, result=None, error=None):
+        self.status = status
+        self.result = result
+        self.error = error
+        self.finished = timezone.now()
+        self.save(update_fields=['status', 'result', 'error', 'finished'])
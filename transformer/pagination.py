@@ -0,0 +1,97 @@
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+
+from aquarius import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.compat import coreapi, coreschema
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class PackagePagination(PageNumberPagination):
+    """Paginates packages by page number, or by cursor if the `cursor` query
+    parameter is present.
+
+    A cursor holds the `last_modified` and `id` of the last package on a page.
+    The next page is selected by filtering on those values rather than by
+    offset, using the package_modified_idx index, and packages are not counted,
+    so each page takes the same time however many packages there are. An empty
+    cursor returns the first page.
+    """
+    page_size = settings.PACKAGE_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.PACKAGE_MAX_PAGE_SIZE
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.use_cursor = self.cursor_query_param in request.query_params
+        if not self.use_cursor:
+            return super(PackagePagination, self).paginate_queryset(queryset, request, view)
+        self.request = request
+        page_size = self.get_page_size(request)
+        queryset = queryset.order_by('-last_modified', '-id')
+        position = self.decode_cursor(request.query_params[self.cursor_query_param])
+        if position:
+            last_modified, pk = position
+            # The redundant `last_modified__lte` lets the index be used to find
+            # the start of the page.
+            queryset = queryset.filter(
+                Q(last_modified__lte=last_modified),
+                Q(last_modified__lt=last_modified) | Q(id__lt=pk))
+        results = list(queryset[:page_size + 1])
+        self.next_position = None
+        if len(results) > page_size:
+            results = results[:page_size]
+            self.next_position = (results[-1].last_modified, results[-1].pk)
+        return results
+
+    def decode_cursor(self, cursor):
+        """Returns the (last_modified, id) position encoded in a cursor, or
+        None for an empty cursor."""
+        if not cursor:
+            return None
+        try:
+            last_modified, pk = b64decode(cursor.encode('ascii'), altchars=b'-_').decode('ascii').split('|')
+            position = (parse_datetime(last_modified), int(pk))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not position[0]:
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def encode_cursor(self, position):
+        value = '|'.join([position[0].isoformat(), str(position[1])])
+        return b64encode(value.encode('ascii'), altchars=b'-_').decode('ascii')
+
+    def get_next_link(self):
+        if not self.use_cursor:
+            return super(PackagePagination, self).get_next_link()
+        if not self.next_position:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        if not self.use_cursor:
+            return super(PackagePagination, self).get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data)
+        ]))
+
+    def get_schema_fields(self, view):
+        return super(PackagePagination, self).get_schema_fields(view) + [
+            coreapi.Field(
+                name=self.cursor_query_param,
+                required=False,
+                location='query',
+                schema=coreschema.String(
+                    title='Cursor',
+                    description='The pagination cursor value. Pass an empty value for the first page.'
+                )
+            )
+        ]
@@ -0,0 +1,17 @@
+import codecs
+import json
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser):
+    """Parses newline-delimited JSON into a list, reading one line at a time."""
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', 'utf-8')
+        try:
+            return [json.loads(line) for line in codecs.getreader(encoding)(stream) if line.strip()]
+        except ValueError as exc:
+            raise ParseError('NDJSON parse error - {}'.format(exc))
@@ -1,15 +1,30 @@
-import json
+import asyncio
+import threading
 import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+from datetime import date
+from functools import partial, reduce
+from operator import or_
 
 from aquarius import settings
-from odin.codecs import json_codec
+from asterism.views import prepare_response
+from django.db import connections, transaction
+from django.utils import timezone
 
-from .clients import ArchivesSpaceClient, AuroraClient, UrsaMajorClient
+from .cache import agent_cache
+from .clients import (AccessionNumberConflictError, ArchivesSpaceClient,
+                      AsyncArchivesSpaceClient, AsyncUrsaMajorClient,
+                      AuroraClient, UrsaMajorClient, shared_client)
 from .mappings import (SourceAccessionToArchivesSpaceAccession,
                        SourceAccessionToGroupingComponent,
                        SourcePackageToDigitalObject,
-                       SourceTransferToTransferComponent, map_agents)
-from .models import Package
+                       SourceTransferToTransferComponent, dump_resource,
+                       map_agents, transform)
+from .models import (AccessionNumberSequence, Job, Package, advisory_lock,
+                     advisory_unlock, try_advisory_lock)
 from .resources.source import (SourceAccession, SourceCreator, SourcePackage,
                                SourceTransfer)
 
@@ -22,11 +37,28 @@ class UpdateRequestError(Exception):
     pass
 
 
-class Routine:
+class ClaimMixin(object):
+    """Renews the lease on the packages claimed by a routine while they are
+    processed.
+
+    `renew_claims` is called as packages are processed, and renews the lease
+    at most once every third of CLAIM_LEASE, so that a batch which takes
+    longer than the lease is not claimed by another process.
+    """
+
+    claims_renewed = 0
+
+    def renew_claims(self):
+        if time.time() - self.claims_renewed > settings.CLAIM_LEASE / 3:
+            self.claims_renewed = time.time()
+            Package.objects.renew(self.claim_owner)
+
+
+class Routine(ClaimMixin):
     """Base routine class which is inherited by all other routines.
 
-    Provides default clients for ArchivesSpace and Ursa Major, and instantiates
-    a DataTransformer class.
+    Provides default clients for ArchivesSpace and Ursa Major, which are shared
+    by all routines in a process, and instantiates a DataTransformer class.
 
     The `apply_transformations` method in the `run` function is intended to be
     overriden by routines which interact with specific types of objects.
@@ -38,52 +70,470 @@ class Routine:
         from_resource - an odin.Resource which represents source data.
         mapping - an odin.Mapping which mapps the from_resource to the desired
                     output.
+    `json_fields` lists the JSON fields of Package read by the routine. Other
+    JSON fields are not loaded.
     """
 
+    json_fields = ('data', 'accession_data')
+
     def __init__(self):
-        self.aspace_client = ArchivesSpaceClient(settings.ARCHIVESSPACE["baseurl"],
-                                                 settings.ARCHIVESSPACE["username"],
-                                                 settings.ARCHIVESSPACE["password"],
-                                                 settings.ARCHIVESSPACE["repo_id"])
-        self.ursa_major_client = UrsaMajorClient(settings.URSA_MAJOR["baseurl"])
+        self.aspace_client = shared_client(ArchivesSpaceClient,
+                                           settings.ARCHIVESSPACE["baseurl"],
+                                           settings.ARCHIVESSPACE["username"],
+                                           settings.ARCHIVESSPACE["password"],
+                                           settings.ARCHIVESSPACE["repo_id"],
+                                           **settings.HTTP_CLIENT)
+        self.ursa_major_client = shared_client(UrsaMajorClient, settings.URSA_MAJOR["baseurl"], **settings.HTTP_CLIENT)
         self.start_time = int(time.time())
+        self.claim_owner = uuid.uuid4().hex
+        self.progress_callback = None
+        self.loaded_packages = {}
 
     def run(self):
+        packages = self.select_fields(self.get_queryset())
+        skipped = []
+        abandoned = []
+        if settings.ISOLATE_FAILURES:
+            skipped = list(packages.waiting().values_list("bag_identifier", flat=True))
+            abandoned = self.format_abandoned(packages)
+            packages = packages.eligible()
+        package_ids = []
+        errors = []
+        try:
+            for batch in packages.claim_batches(self.claim_owner, settings.CLAIM_BATCH_SIZE, self.claim_related):
+                processed, failed = self.process_batch(batch)
+                package_ids += processed
+                errors += failed
+                self.report_progress(len(package_ids), len(errors))
+                if failed and not settings.ISOLATE_FAILURES:
+                    break
+        finally:
+            self.close()
+        self.raise_errors(errors)
+        message = ("{} created.".format(self.object_type) if (len(package_ids) > 0)
+                   else "{} updated.".format(self.object_type))
+        if settings.ISOLATE_FAILURES:
+            return (message, {
+                "succeeded": package_ids,
+                "failed": self.format_failures(errors),
+                "skipped": skipped,
+                "abandoned": abandoned})
+        return (message, package_ids)
+
+    def get_queryset(self):
+        return Package.objects.filter(process_status=self.start_status)
+
+    @classmethod
+    def select_fields(cls, packages):
+        """Defers JSON fields which are not read by the routine."""
+        return packages.with_json(*cls.json_fields)
+
+    def accepts(self, package):
+        """Returns True if a package is ready to be processed by this routine."""
+        return package.process_status == self.start_status
+
+    def process_batch(self, packages, batch=None):
+        """Processes a batch of claimed packages, returning the identifiers of
+        processed packages and a list of errors.
+
+        Each package is loaded once. Packages in the batch, or in `batch` if
+        only some of a larger batch are being processed, are kept in
+        `loaded_packages`, keyed by primary key, so that changes made to
+        sibling packages can be applied to the loaded objects as well as to
+        the database.
+        """
+        self.loaded_packages = OrderedDict((p.pk, p) for p in (batch or packages))
+        self.prefetch(packages)
+        return self.process_packages(packages)
+
+    def get_loaded_siblings(self, bag_identifiers):
+        """Returns packages in the current batch with the given bag identifiers."""
+        return [p for p in self.loaded_packages.values() if p.bag_identifier in bag_identifiers]
+
+    def raise_errors(self, errors):
+        """Raises errors from processing packages, unless failures are isolated."""
+        if errors and not settings.ISOLATE_FAILURES:
+            if len(errors) == 1:
+                raise errors[0]
+            raise RoutineError(
+                "; ".join(OrderedDict.fromkeys(str(e.args[0]) for e in errors)), [e.args[1] for e in errors])
+
+    def format_failures(self, errors):
+        return [{"identifier": e.args[1], "error": e.args[0]} for e in errors]
+
+    @staticmethod
+    def format_abandoned(packages):
+        """Lists packages which are no longer retried, with their last error."""
+        return [{"identifier": identifier, "error": error} for identifier, error in packages.abandoned().values_list(
+            "bag_identifier", "error_message")]
+
+    def close(self):
+        """Releases resources held by the routine once it has finished."""
+        pass
+
+    def report_progress(self, processed, failed):
+        """Reports the number of packages processed after each batch, if
+        `progress_callback` is set."""
+        if self.progress_callback:
+            self.progress_callback(processed, failed)
+
+    def claim_related(self, packages, batch):
+        """Returns further pending packages, claimed from `packages`, which
+        must be processed in the same batch as the claimed packages in
+        `batch`.
+
+        AIP and DIP packages for the same bag update each other's data, so by
+        default packages for the same bags are claimed, and are not processed
+        by routines in other processes. Overridden by routines which process
+        packages in larger groups. No more related packages are claimed than
+        there are packages in the batch, so that a batch is at most twice the
+        batch size.
+        """
+        return list(packages.filter(bag_identifier__in=set(p.bag_identifier for p in batch)).exclude(
+            pk__in=[p.pk for p in batch]).claim(self.claim_owner, len(batch)))
+
+    def prefetch(self, packages):
+        """Fetches data needed by all pending packages before they are processed.
+
+        Overridden by routines which can retrieve data in bulk.
+        """
+        pass
+
+    def process_packages(self, packages):
+        """Returns the identifiers of processed packages, and a list of errors."""
+        if settings.ROUTINE_WORKERS > 1:
+            return self.run_concurrent(packages)
+        return self.process_group(packages)
+
+    def process_groups(self, packages):
+        """Processes packages in groups which share a group key, in parallel
+        if ROUTINE_WORKERS is greater than 1, and otherwise one group at a
+        time.
+
+        Used by routines which must process each group as a whole.
+        """
+        if settings.ROUTINE_WORKERS > 1:
+            return self.run_concurrent(packages)
+        package_ids = []
+        errors = []
+        for group in self.group_packages(packages):
+            processed, failed = self.process_group(group)
+            package_ids += processed
+            errors += failed
+            self.renew_claims()
+            if failed and not settings.ISOLATE_FAILURES:
+                break
+        return package_ids, errors
+
+    def run_concurrent(self, packages):
+        """Processes packages in parallel using a bounded pool of threads.
+
+        Packages which share a group key are processed in order by a single
+        worker, so that data written to siblings by one package is visible to
+        the next. Errors are collected for every group.
+        """
         package_ids = []
+        errors = []
+        with ThreadPoolExecutor(max_workers=settings.ROUTINE_WORKERS) as executor:
+            for processed, failed in executor.map(
+                    self.process_group_in_thread, self.group_packages(packages, executor.map)):
+                package_ids += processed
+                errors += failed
+        return package_ids, errors
+
+    def group_packages(self, packages, map=map):
+        """Returns lists of packages which share a group key, in order."""
+        groups = OrderedDict()
+        packages = list(packages)
+        for package, key in zip(packages, map(self.resolve_group_key, packages)):
+            groups.setdefault(key, []).append(package)
+        return list(groups.values())
 
-        for package in Package.objects.filter(process_status=self.start_status):
+    def process_group_in_thread(self, packages):
+        try:
+            result = self.process_group(packages)
+            self.renew_claims()
+            return result
+        finally:
+            connections.close_all()
+
+    def process_group(self, packages):
+        """Processes a group of packages in order.
+
+        Unless failures are isolated, processing stops at the first error.
+        Otherwise the error is saved on the package and the group continues.
+        """
+        processed = []
+        errors = []
+        for package in packages:
             try:
-                package.refresh_from_db()
+                self.process_package(package)
+                processed.append(package.bag_identifier)
+            except RoutineError as e:
+                errors.append(e)
+                if not settings.ISOLATE_FAILURES:
+                    break
+                package.record_failure(e.args[0])
+            self.renew_claims()
+        return processed, errors
+
+    def process_package(self, package):
+        try:
+            if not self.get_existing_uri(package):
                 initial_data = self.get_data(package)
                 transformed = self.get_transformed_object(initial_data, self.from_resource, self.mapping)
                 obj_uri = self.save_transformed_object(transformed)
                 if obj_uri:
                     self.post_save_actions(package, initial_data, transformed, obj_uri)
-                package.process_status = self.end_status
-                package.save()
-                package_ids.append(package.bag_identifier)
-            except Exception as e:
-                raise RoutineError("{} error: {}".format(self.object_type, e), package.bag_identifier)
-        message = ("{} created.".format(self.object_type) if (len(package_ids) > 0)
-                   else "{} updated.".format(self.object_type))
-        return (message, package_ids)
+            package.process_status = self.end_status
+            package.clear_failure()
+            package.save()
+        except Exception as e:
+            raise RoutineError("{} error: {}".format(self.object_type, e), package.bag_identifier)
+
+    def get_existing_uri(self, package):
+        """Returns the URI of the object for a package if it was already
+        created, for example while processing a sibling package, in which case
+        it is not created again."""
+        return None
+
+    def resolve_group_key(self, package):
+        try:
+            return self.get_group_key(package)
+        except Exception:
+            # The package is processed on its own, where the error is raised again and reported.
+            return package.bag_identifier
+
+    def get_group_key(self, package):
+        """Returns a key shared by packages which must be processed in order.
+
+        AIP and DIP packages for the same bag update each other's data, so
+        they are grouped by bag identifier by default.
+        """
+        return package.bag_identifier
 
     def get_transformed_object(self, data, from_resource, mapping):
-        from_obj = json_codec.loads(json.dumps(data), resource=from_resource)
-        return json.loads(json_codec.dumps(mapping.apply(from_obj)))
+        return transform(data, from_resource, mapping)
 
     def get_linked_agents(self, agents):
-        linked_agents = []
-        for agent in agents:
-            agent_data = map_agents(SourceCreator(type=agent["type"], name=agent["name"]))
+        return [self.get_linked_agent(agent) for agent in agents]
+
+    def get_linked_agent(self, agent):
+        agent_ref = agent_cache.get(agent["type"], agent["name"])
+        if not agent_ref:
             agent_ref = self.aspace_client.get_or_create(
                 agent["type"], "title", agent["name"],
-                self.start_time, json.loads(json_codec.dumps(agent_data)))
-            linked_agents.append({"uri": agent_ref})
-        return linked_agents
+                self.start_time, self.get_agent_data(agent))
+            agent_cache.set(agent["type"], agent["name"], agent_ref)
+        return {"uri": agent_ref}
+
+    def get_agent_data(self, agent):
+        agent_data = map_agents(SourceCreator(type=agent["type"], name=agent["name"]))
+        return dump_resource(agent_data)
 
 
-class AccessionRoutine(Routine):
+class AsyncRoutineMixin(object):
+    """Processes packages on an asyncio event loop.
+
+    Groups of packages are processed concurrently, up to ROUTINE_WORKERS
+    groups at a time, and independent requests for a package, such as
+    resolving its linked agents, are made concurrently with asyncio.gather.
+
+    HTTP requests are run in a thread pool the size of the HTTP connection
+    pool. Database queries are run in a single thread so that they share one
+    connection, which is closed when the routine finishes.
+    """
+
+    def __init__(self):
+        super(AsyncRoutineMixin, self).__init__()
+        self.http_executor = ThreadPoolExecutor(max_workers=settings.HTTP_CLIENT["pool_size"])
+        self.db_executor = ThreadPoolExecutor(max_workers=1)
+        self.async_aspace_client = AsyncArchivesSpaceClient(self.aspace_client, self.http_executor)
+        self.async_ursa_major_client = AsyncUrsaMajorClient(self.ursa_major_client, self.http_executor)
+
+    def process_packages(self, packages):
+        packages = list(packages)
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self.process_packages_async(packages))
+        finally:
+            loop.close()
+
+    def close(self):
+        self.db_executor.submit(connections.close_all).result()
+        self.db_executor.shutdown()
+        self.http_executor.shutdown()
+
+    async def run_in_db(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(self.db_executor, partial(func, *args))
+
+    async def run_in_http(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(
+            self.http_executor, partial(self.call_and_close, func, *args))
+
+    def call_and_close(self, func, *args):
+        """Closes any database connection opened by a function in an HTTP thread."""
+        try:
+            return func(*args)
+        finally:
+            connections.close_all()
+
+    async def process_packages_async(self, packages):
+        semaphore = asyncio.Semaphore(max(settings.ROUTINE_WORKERS, 1))
+        keys = await asyncio.gather(*[self.run_in_http(self.resolve_group_key, p) for p in packages])
+        groups = OrderedDict()
+        for package, key in zip(packages, keys):
+            groups.setdefault(key, []).append(package)
+        package_ids = []
+        errors = []
+        for processed, failed in await asyncio.gather(
+                *[self.process_group_and_renew_async(group, semaphore) for group in groups.values()]):
+            package_ids += processed
+            errors += failed
+        return package_ids, errors
+
+    async def process_group_and_renew_async(self, packages, semaphore):
+        result = await self.process_group_async(packages, semaphore)
+        await self.run_in_db(self.renew_claims)
+        return result
+
+    async def process_group_async(self, packages, semaphore):
+        processed = []
+        errors = []
+        async with semaphore:
+            for package in packages:
+                try:
+                    await self.process_package_async(package)
+                    processed.append(package.bag_identifier)
+                except RoutineError as e:
+                    errors.append(e)
+                    if not settings.ISOLATE_FAILURES:
+                        break
+                    await self.run_in_db(package.record_failure, e.args[0])
+        return processed, errors
+
+    async def process_package_async(self, package):
+        try:
+            if not self.get_existing_uri(package):
+                initial_data = await self.get_data_async(package)
+                transformed = self.get_transformed_object(initial_data, self.from_resource, self.mapping)
+                obj_uri = await self.save_transformed_object_async(transformed)
+                if obj_uri:
+                    await self.post_save_actions_async(package, initial_data, transformed, obj_uri)
+            package.process_status = self.end_status
+            package.clear_failure()
+            await self.run_in_db(package.save)
+        except Exception as e:
+            raise RoutineError("{} error: {}".format(self.object_type, e), package.bag_identifier)
+
+    async def get_data_async(self, package):
+        return await self.run_in_http(self.get_data, package)
+
+    async def save_transformed_object_async(self, transformed):
+        return await self.run_in_http(self.save_transformed_object, transformed)
+
+    async def post_save_actions_async(self, package, full_data, transformed, obj_uri):
+        return await self.run_in_db(self.post_save_actions, package, full_data, transformed, obj_uri)
+
+    async def get_linked_agents_async(self, agents):
+        return list(await asyncio.gather(*[self.get_linked_agent_async(agent) for agent in agents]))
+
+    async def get_linked_agent_async(self, agent):
+        agent_ref = await self.run_in_db(agent_cache.get, agent["type"], agent["name"])
+        if not agent_ref:
+            agent_ref = await self.async_aspace_client.get_or_create(
+                agent["type"], "title", agent["name"],
+                self.start_time, self.get_agent_data(agent))
+            await self.run_in_db(agent_cache.set, agent["type"], agent["name"], agent_ref)
+        return {"uri": agent_ref}
+
+
+class AccessionGroupMixin(object):
+    """Processes pending packages in groups by accession.
+
+    The object for an accession is created once, from the first package in
+    the group, unless it already exists. The result is then saved on every
+    package in the group in a single transaction.
+
+    Routines using this mixin must implement `get_existing_uri`, and
+    `apply_to_member`, which copies results to another package in the group.
+    Fields changed by `apply_to_member` are listed in `group_fields`.
+    """
+
+    def process_packages(self, packages):
+        return self.process_groups(packages)
+
+    def get_creators(self, package):
+        """Returns the agents to link to an accession's objects: its creators
+        and the organization which transferred it."""
+        data = package.accession_data["data"]
+        return data["creators"] + [{"name": data["organization"], "type": "organization"}]
+
+    def process_group(self, packages):
+        """Processes a group while holding an advisory lock on its group key.
+
+        Packages for an accession may be claimed by routines in other
+        processes, since they are not known until their bags are fetched, and
+        related packages are claimed only up to the size of a batch. The lock
+        makes those routines wait until the object for the accession is
+        created, which they then find with `reload_group`.
+        """
+        packages = list(packages)
+        key = self.get_lock_key(packages[0])
+        if not key:
+            return self.create_for_group(packages)
+        with advisory_lock(key):
+            self.reload_group(packages)
+            return self.create_for_group(packages)
+
+    def get_lock_key(self, package):
+        """Returns the key of the advisory lock held while the object for a
+        group is created, or None if the group key cannot be found."""
+        try:
+            return "{}:{}".format(self.object_type, self.get_group_key(package))
+        except Exception:
+            return None
+
+    def create_for_group(self, packages):
+        package = packages[0]
+        try:
+            initial_data = self.get_data(package)
+            transformed = None
+            obj_uri = None
+            if not self.get_existing_uri(package):
+                transformed = self.get_transformed_object(initial_data, self.from_resource, self.mapping)
+                obj_uri = self.save_transformed_object(transformed)
+            self.save_group(package, packages, initial_data, transformed, obj_uri)
+        except Exception as e:
+            return [], self.handle_group_error(packages, "{} error: {}".format(self.object_type, e))
+        return [p.bag_identifier for p in packages], []
+
+    def save_group(self, package, packages, initial_data, transformed, obj_uri):
+        """Saves the results for a group of packages in a single transaction."""
+        with transaction.atomic():
+            if obj_uri:
+                self.post_save_actions(package, initial_data, transformed, obj_uri)
+            self.apply_to_group(package, packages)
+
+    def handle_group_error(self, packages, message):
+        if settings.ISOLATE_FAILURES:
+            for p in packages:
+                p.record_failure(message)
+        return [RoutineError(message, p.bag_identifier) for p in packages]
+
+    def apply_to_group(self, package, packages):
+        now = timezone.now()
+        for member in packages:
+            if member is not package:
+                self.apply_to_member(package, member)
+            member.process_status = self.end_status
+            member.clear_failure()
+            member.last_modified = now
+        Package.objects.bulk_update(
+            packages, self.group_fields + ["process_status", "error_message", "attempt_count", "next_attempt", "last_modified"])
+
+
+class AccessionRoutine(AccessionGroupMixin, Routine):
     """Transforms and saves accession data."""
 
     start_status = Package.SAVED
@@ -91,41 +541,149 @@ class AccessionRoutine(Routine):
     object_type = "Accession"
     from_resource = SourceAccession
     mapping = SourceAccessionToArchivesSpaceAccession
+    accession_number_attempts = 5
+    group_fields = ["data", "accession_data"]
+
+    def __init__(self):
+        super(AccessionRoutine, self).__init__()
+        self.bags = {}
+        self.accessions = {}
+
+    def get_group_key(self, package):
+        return self.find_bag(package)["accession"]
+
+    def process_batch(self, packages, batch=None):
+        """Bag and accession data is only kept while a batch is processed, so
+        that routines which process many batches, or are reused by the
+        pipeline, do not hold data for every package."""
+        try:
+            return super(AccessionRoutine, self).process_batch(packages, batch)
+        finally:
+            self.bags = {}
+            self.accessions = {}
+
+    def reload_group(self, packages):
+        """Looks again for data saved for an accession, unless its accession
+        and grouping component were both found earlier in the batch.
+
+        They may since have been created by another process, or, when the
+        accession is split between batches of the pipeline, by a later stage.
+        """
+        url = self.get_group_key(packages[0])
+        accession = self.accessions.get(url)
+        if not (accession and accession["archivesspace_parent_identifier"]):
+            self.accessions.pop(url, None)
+            self.load_accessions([url])
+
+    def prefetch(self, packages):
+        """Fetches each pending bag from Ursa Major once, in parallel, and then
+        finds data already saved for their accessions.
+
+        Errors are ignored here, since bags which could not be fetched are
+        requested again for each package, where errors are reported.
+        """
+        packages = OrderedDict((p.bag_identifier, p) for p in packages if p.bag_identifier not in self.bags)
+        with ThreadPoolExecutor(max_workers=max(settings.ROUTINE_WORKERS, 1)) as executor:
+            for future in [executor.submit(self.find_bag, package) for package in packages.values()]:
+                try:
+                    future.result()
+                except Exception:
+                    pass
+        self.load_accessions(bag["accession"] for bag in self.bags.values())
+
+    def load_accessions(self, accession_urls):
+        """Finds accession data and grouping component URIs already saved on
+        packages for a set of accessions, using a single query.
+
+        Results are kept for the rest of the batch, and are updated as each
+        accession is created.
+        """
+        accession_urls = set(accession_urls) - set(self.accessions)
+        if not accession_urls:
+            return
+        for url in accession_urls:
+            self.accessions[url] = None
+        siblings = Package.objects.filter(
+            data__accession__in=list(accession_urls), accession_data__isnull=False).annotate_json(
+                accession_url=("data", "accession"),
+                parent_identifier=("data", "data", "archivesspace_parent_identifier"))
+        for url, parent_identifier, accession_data in siblings.values_list(
+                "accession_url", "parent_identifier", "accession_data"):
+            # Packages with a grouping component URI are preferred.
+            if not self.accessions[url] or (
+                    parent_identifier and not self.accessions[url]["archivesspace_parent_identifier"]):
+                self.accessions[url] = {
+                    "accession_data": accession_data,
+                    "archivesspace_parent_identifier": parent_identifier}
+
+    def find_bag(self, package):
+        """Returns bag data from Ursa Major, fetching each bag only once per batch."""
+        if package.bag_identifier not in self.bags:
+            self.bags[package.bag_identifier] = self.ursa_major_client.find_bag_by_id(package.bag_identifier)
+        return deepcopy(self.bags[package.bag_identifier])
 
     def get_data(self, package):
-        package.data = self.ursa_major_client.find_bag_by_id(package.bag_identifier)
+        package.data = self.find_bag(package)
         self.discover_sibling_data(package)
         if not package.accession_data:
             package.accession_data = self.ursa_major_client.retrieve(package.data["accession"])
-        package.accession_data["data"]["accession_number"] = self.aspace_client.next_accession_number()
-        package.accession_data["data"]["linked_agents"] = self.get_linked_agents(
-            package.accession_data["data"]["creators"] + [
-                {"name": package.accession_data["data"]["organization"], "type": "organization"}])
+        if not self.get_existing_uri(package):
+            package.accession_data["data"]["accession_number"] = self.next_accession_number()
+            package.accession_data["data"]["linked_agents"] = self.get_linked_agents(self.get_creators(package))
         return package.accession_data["data"]
 
+    def get_existing_uri(self, package):
+        return package.accession_data["data"].get("archivesspace_identifier")
+
+    def apply_to_member(self, package, member):
+        member.data = self.find_bag(member)
+        member.data["data"]["archivesspace_parent_identifier"] = \
+            package.data["data"].get("archivesspace_parent_identifier")
+        member.accession_data = package.accession_data
+
+    def next_accession_number(self):
+        """Allocates the next accession number for the current year.
+
+        The first number is seeded from ArchivesSpace; after that numbers are
+        allocated by Aquarius without searching ArchivesSpace.
+        """
+        year = date.today().year
+        number = AccessionNumberSequence.next_number(
+            year, lambda: int(self.aspace_client.next_accession_number().split(":")[1]) - 1)
+        return ":".join([str(year), str(number).zfill(3)])
+
     def save_transformed_object(self, transformed):
         if not transformed.get("archivesspace_identifier"):
-            return self.aspace_client.create(transformed, "accession").get("uri")
+            for _ in range(self.accession_number_attempts):
+                try:
+                    return self.aspace_client.create(transformed, "accession").get("uri")
+                except AccessionNumberConflictError:
+                    # Numbers assigned outside Aquarius are skipped.
+                    transformed["id_0"], transformed["id_1"] = self.next_accession_number().split(":")
+            raise RoutineError("Could not find an unused accession number after {} attempts".format(
+                self.accession_number_attempts))
 
     def post_save_actions(self, package, full_data, transformed, accession_uri):
         package.accession_data["data"]["archivesspace_identifier"] = accession_uri
-        package.accession_data["data"]["accession_number"] = full_data.get("accession_number")
-        for p in package.accession_data["data"]["transfers"]:
-            for sibling in Package.objects.filter(bag_identifier=p["identifier"]):
-                sibling.accession_data = package.accession_data
-                sibling.save()
+        package.accession_data["data"]["accession_number"] = ":".join([transformed["id_0"], transformed["id_1"]])
+        transfers = [p["identifier"] for p in package.accession_data["data"]["transfers"]]
+        Package.objects.filter(bag_identifier__in=transfers).update(
+            accession_data=package.accession_data, last_modified=timezone.now())
+        for sibling in self.get_loaded_siblings(transfers):
+            sibling.accession_data = deepcopy(package.accession_data)
+        self.accessions[package.data["accession"]] = {
+            "accession_data": deepcopy(package.accession_data),
+            "archivesspace_parent_identifier": package.data["data"].get("archivesspace_parent_identifier")}
 
     def discover_sibling_data(self, package):
-        if Package.objects.filter(
-                data__accession=package.data["accession"], accession_data__isnull=False).exists():
-            sibling = Package.objects.filter(
-                data__accession=package.data["accession"], accession_data__isnull=False)[0]
-            package.accession_data = sibling.accession_data
-            package.data["data"]["archivesspace_parent_identifier"] = \
-                sibling.data["data"].get("archivesspace_parent_identifier")
+        self.load_accessions([package.data["accession"]])
+        sibling = self.accessions[package.data["accession"]]
+        if sibling:
+            package.accession_data = deepcopy(sibling["accession_data"])
+            package.data["data"]["archivesspace_parent_identifier"] = sibling["archivesspace_parent_identifier"]
 
 
-class GroupingComponentRoutine(Routine):
+class GroupingComponentRoutine(AccessionGroupMixin, Routine):
     """Transforms and saves grouping component data."""
 
     start_status = Package.ACCESSION_UPDATE_SENT
@@ -133,24 +691,56 @@ class GroupingComponentRoutine(Routine):
     object_type = "Grouping component"
     from_resource = SourceAccession
     mapping = SourceAccessionToGroupingComponent
+    group_fields = ["data"]
+
+    def get_group_key(self, package):
+        return package.data["accession"]
+
+    def claim_related(self, packages, batch):
+        """Claims pending packages for the same accessions, so that one
+        grouping component is created for each accession."""
+        accessions = set(p.data["accession"] for p in batch if p.data and p.data.get("accession"))
+        if not accessions:
+            return []
+        return list(packages.filter(data__accession__in=list(accessions)).exclude(
+            pk__in=[p.pk for p in batch]).claim(self.claim_owner, len(batch)))
 
     def get_data(self, package):
         data = package.accession_data["data"]
         data["level"] = "recordgrp"
-        data["linked_agents"] = self.get_linked_agents(
-            data["creators"] + [
-                {"name": data["organization"], "type": "organization"}])
+        if not self.get_existing_uri(package):
+            data["linked_agents"] = self.get_linked_agents(self.get_creators(package))
         return data
 
+    def get_existing_uri(self, package):
+        return package.data["data"].get("archivesspace_parent_identifier")
+
+    def reload_group(self, packages):
+        """Reads grouping component URIs saved on the packages in a group,
+        which may have been created by another process since the packages
+        were loaded."""
+        uris = dict(Package.objects.filter(pk__in=[p.pk for p in packages]).annotate_json(
+            parent_identifier=("data", "data", "archivesspace_parent_identifier")).values_list(
+                "pk", "parent_identifier"))
+        for package in packages:
+            if uris.get(package.pk):
+                package.data["data"]["archivesspace_parent_identifier"] = uris[package.pk]
+
+    def apply_to_member(self, package, member):
+        member.data["data"]["archivesspace_parent_identifier"] = \
+            package.data["data"]["archivesspace_parent_identifier"]
+
     def save_transformed_object(self, transformed):
         if not transformed.get("archivesspace_identifier"):
             return self.aspace_client.create(transformed, "component").get("uri")
 
     def post_save_actions(self, package, full_data, transformed, parent_uri):
-        for p in package.accession_data["data"]["transfers"]:
-            for sibling in Package.objects.filter(bag_identifier=p["identifier"]):
-                sibling.data["data"]["archivesspace_parent_identifier"] = parent_uri
-                sibling.save()
+        package.data["data"]["archivesspace_parent_identifier"] = parent_uri
+        transfers = [p["identifier"] for p in package.accession_data["data"]["transfers"]]
+        Package.objects.filter(bag_identifier__in=transfers).update_data(
+            ["data", "archivesspace_parent_identifier"], parent_uri)
+        for sibling in self.get_loaded_siblings(transfers):
+            sibling.data["data"]["archivesspace_parent_identifier"] = parent_uri
 
 
 class TransferComponentRoutine(Routine):
@@ -166,20 +756,27 @@ class TransferComponentRoutine(Routine):
         data = package.data["data"]
         data["resource"] = package.accession_data["data"]["resource"]
         data["level"] = "file"
-        data["linked_agents"] = self.get_linked_agents(
-            data["metadata"]["record_creators"] + [
-                {"name": data["metadata"]["source_organization"], "type": "organization"}])
+        data["linked_agents"] = self.get_linked_agents(self.get_creators(package))
         return data
 
+    def get_creators(self, package):
+        """Returns the agents to link to a transfer component: the creators of
+        its records and the organization which transferred it."""
+        metadata = package.data["data"]["metadata"]
+        return metadata["record_creators"] + [{"name": metadata["source_organization"], "type": "organization"}]
+
+    def get_existing_uri(self, package):
+        return package.data["data"].get("archivesspace_identifier")
+
     def save_transformed_object(self, transformed):
-        if not transformed.get("archivesspace_identifier"):
-            return self.aspace_client.create(transformed, "component").get("uri")
+        return self.aspace_client.create(transformed, "component").get("uri")
 
     def post_save_actions(self, package, full_data, transformed, transfer_uri):
         package.data["data"]["archivesspace_identifier"] = transfer_uri
-        for sibling in Package.objects.filter(bag_identifier=package.bag_identifier):
+        Package.objects.filter(bag_identifier=package.bag_identifier).update_data(
+            ["data", "archivesspace_identifier"], transfer_uri)
+        for sibling in self.get_loaded_siblings([package.bag_identifier]):
             sibling.data["data"]["archivesspace_identifier"] = transfer_uri
-            sibling.save()
 
 
 class DigitalObjectRoutine(Routine):
@@ -190,6 +787,28 @@ class DigitalObjectRoutine(Routine):
     object_type = "Digital object"
     from_resource = SourcePackage
     mapping = SourcePackageToDigitalObject
+    json_fields = ()
+
+    @classmethod
+    def select_fields(cls, packages):
+        """Selects only the transfer component URI from `data`."""
+        return packages.with_json().annotate_json(transfer_uri=("data", "data", "archivesspace_identifier"))
+
+    def get_transfer_uri(self, package):
+        """Returns the URI selected by `select_fields`, or reads it from the
+        data of a package loaded in full by the pipeline."""
+        if hasattr(package, "transfer_uri"):
+            return package.transfer_uri
+        return package.data["data"]["archivesspace_identifier"]
+
+    def get_group_key(self, package):
+        return self.get_transfer_uri(package)
+
+    def process_packages(self, packages):
+        """Processes packages in groups by transfer component, so that the
+        digital objects in each group are linked to their own transfer
+        component."""
+        return self.process_groups(packages)
 
     def get_data(self, package):
         return {"fedora_uri": package.fedora_uri, "use_statement": package.use_statement}
@@ -197,17 +816,190 @@ class DigitalObjectRoutine(Routine):
     def save_transformed_object(self, transformed):
         return self.aspace_client.create(transformed, "digital object").get("uri")
 
-    def post_save_actions(self, package, full_data, transformed, do_uri):
-        transfer_component = self.aspace_client.retrieve(package.data["data"]["archivesspace_identifier"])
-        transfer_component["instances"].append(
-            {"instance_type": "digital_object",
-             "jsonmodel_type": "instance",
-             "digital_object": {"ref": do_uri}
-             })
-        self.aspace_client.update(package.data["data"]["archivesspace_identifier"], transfer_component)
+    def process_group(self, packages):
+        """Creates a digital object for each package in a group, and then
+        links them to their transfer component with a single update."""
+        errors = []
+        created = []
+        for package in packages:
+            try:
+                created.append((package, self.create_digital_object(package)))
+            except RoutineError as e:
+                errors.append(e)
+                if not settings.ISOLATE_FAILURES:
+                    break
+                package.record_failure(e.args[0])
+        if not created:
+            return [], errors
+        processed, failed = self.save_group(created)
+        return processed, failed + errors
+
+    def create_digital_object(self, package):
+        """Returns the URI of a new digital object for a package.
+
+        The URI is saved on the package before the digital object is linked to
+        its transfer component, so if linking fails, the same digital object
+        is linked when the package is retried rather than a new one created.
+        """
+        if not package.digital_object_uri:
+            self.save_digital_object_uri(package, self.post_digital_object(package))
+        return package.digital_object_uri
+
+    def post_digital_object(self, package):
+        try:
+            transformed = self.get_transformed_object(self.get_data(package), self.from_resource, self.mapping)
+            return self.save_transformed_object(transformed)
+        except Exception as e:
+            raise RoutineError("{} error: {}".format(self.object_type, e), package.bag_identifier)
+
+    def save_digital_object_uri(self, package, do_uri):
+        package.digital_object_uri = do_uri
+        Package.objects.filter(pk=package.pk).update(digital_object_uri=do_uri)
+
+    def save_group(self, created):
+        """Adds instances for new digital objects to their transfer component,
+        and then saves their packages."""
+        return self.save_linked_group(created, self.link_group(created))
+
+    def link_group(self, created):
+        """Adds instances for new digital objects to their transfer component
+        with a single update, and returns an error message if it fails."""
+        try:
+            self.aspace_client.add_instances(
+                self.get_transfer_uri(created[0][0]),
+                [{"instance_type": "digital_object",
+                  "jsonmodel_type": "instance",
+                  "digital_object": {"ref": do_uri}
+                  } for _, do_uri in created])
+        except Exception as e:
+            return "{} error: {}".format(self.object_type, e)
+
+    def save_linked_group(self, created, message=None):
+        """Saves the packages for new digital objects, or saves `message` on
+        them if the digital objects could not be linked."""
+        if message:
+            if settings.ISOLATE_FAILURES:
+                for package, _ in created:
+                    package.record_failure(message)
+            return [], [RoutineError(message, package.bag_identifier) for package, _ in created]
+        for package, _ in created:
+            package.process_status = self.end_status
+            package.clear_failure()
+            package.save()
+        return [package.bag_identifier for package, _ in created], []
+
+
+class AsyncAccessionGroupMixin(object):
+    """Processes groups of packages by accession on an event loop.
+
+    Advisory locks on groups are taken without waiting, and retried every
+    `lock_interval` seconds, since waiting would block the database thread
+    shared by every group.
+    """
+
+    lock_interval = 0.1
+
+    async def process_group_async(self, packages, semaphore):
+        async with semaphore:
+            key = await self.run_in_http(self.get_lock_key, packages[0])
+            if not key:
+                return await self.create_for_group_async(packages)
+            while not await self.run_in_db(try_advisory_lock, key):
+                await asyncio.sleep(self.lock_interval)
+            try:
+                await self.run_in_db(self.reload_group, packages)
+                return await self.create_for_group_async(packages)
+            finally:
+                await self.run_in_db(advisory_unlock, key)
+
+    async def create_for_group_async(self, packages):
+        package = packages[0]
+        try:
+            initial_data = await self.get_data_async(package)
+            transformed = None
+            obj_uri = None
+            if not self.get_existing_uri(package):
+                transformed = self.get_transformed_object(initial_data, self.from_resource, self.mapping)
+                obj_uri = await self.save_transformed_object_async(transformed)
+            await self.run_in_db(self.save_group, package, packages, initial_data, transformed, obj_uri)
+        except Exception as e:
+            message = "{} error: {}".format(self.object_type, e)
+            return [], await self.run_in_db(self.handle_group_error, packages, message)
+        return [p.bag_identifier for p in packages], []
+
+
+class AsyncAccessionRoutine(AsyncAccessionGroupMixin, AsyncRoutineMixin, AccessionRoutine):
+    """Transforms and saves accession data on an event loop."""
+
+    async def get_data_async(self, package):
+        package.data = await self.run_in_http(self.find_bag, package)
+        await self.run_in_db(self.discover_sibling_data, package)
+        if not package.accession_data:
+            package.accession_data = await self.async_ursa_major_client.retrieve(package.data["accession"])
+        data = package.accession_data["data"]
+        if not self.get_existing_uri(package):
+            data["accession_number"], data["linked_agents"] = await asyncio.gather(
+                self.run_in_db(self.next_accession_number),
+                self.get_linked_agents_async(self.get_creators(package)))
+        return data
+
+
+class AsyncGroupingComponentRoutine(AsyncAccessionGroupMixin, AsyncRoutineMixin, GroupingComponentRoutine):
+    """Transforms and saves grouping component data on an event loop."""
+
+    async def get_data_async(self, package):
+        data = package.accession_data["data"]
+        data["level"] = "recordgrp"
+        if not self.get_existing_uri(package):
+            data["linked_agents"] = await self.get_linked_agents_async(self.get_creators(package))
+        return data
+
+
+class AsyncTransferComponentRoutine(AsyncRoutineMixin, TransferComponentRoutine):
+    """Transforms and saves transfer component data on an event loop."""
+
+    async def get_data_async(self, package):
+        data = package.data["data"]
+        data["resource"] = package.accession_data["data"]["resource"]
+        data["level"] = "file"
+        data["linked_agents"] = await self.get_linked_agents_async(self.get_creators(package))
+        return data
+
+
+class AsyncDigitalObjectRoutine(AsyncRoutineMixin, DigitalObjectRoutine):
+    """Transforms and saves digital object data on an event loop.
+
+    Digital objects for a transfer component are created concurrently.
+    """
+
+    async def process_group_async(self, packages, semaphore):
+        errors = []
+        created = []
+        async with semaphore:
+            results = await asyncio.gather(
+                *[self.create_digital_object_async(package) for package in packages],
+                return_exceptions=True)
+            for package, result in zip(packages, results):
+                if isinstance(result, Exception):
+                    errors.append(result)
+                    if settings.ISOLATE_FAILURES:
+                        await self.run_in_db(package.record_failure, result.args[0])
+                else:
+                    created.append((package, result))
+            if not created:
+                return [], errors
+            message = await self.run_in_http(self.link_group, created)
+            processed, failed = await self.run_in_db(self.save_linked_group, created, message)
+        return processed, failed + errors
+
+    async def create_digital_object_async(self, package):
+        if not package.digital_object_uri:
+            do_uri = await self.run_in_http(self.post_digital_object, package)
+            await self.run_in_db(self.save_digital_object_uri, package, do_uri)
+        return package.digital_object_uri
 
 
-class AuroraUpdater:
+class AuroraUpdater(ClaimMixin):
     """Base class for routines that interact with Aurora.
 
     Provides a web client and a `run` method.
@@ -216,35 +1008,95 @@ class AuroraUpdater:
     the data object to be delivered to Aurora, as well as any changes to that
     object. Classes inheriting this class should also specify a `start_status`
     and an `end_status`, which determine the queryset of objects acted on and
-    the status to which those objects are updated, respectively.
+    the status to which those objects are updated, respectively, and may
+    limit the JSON fields loaded with `json_fields`.
     """
 
+    json_fields = ('data', 'accession_data')
+
     def __init__(self):
-        self.client = AuroraClient(baseurl=settings.AURORA["baseurl"],
-                                   username=settings.AURORA["username"],
-                                   password=settings.AURORA["password"])
+        self.client = shared_client(AuroraClient,
+                                    baseurl=settings.AURORA["baseurl"],
+                                    username=settings.AURORA["username"],
+                                    password=settings.AURORA["password"],
+                                    **settings.HTTP_CLIENT)
+        self.claim_owner = uuid.uuid4().hex
+        self.progress_callback = None
 
     def run(self):
         update_ids = []
-        for obj in Package.objects.filter(process_status=self.start_status, origin="aurora"):
-            try:
-                data = self.update_data(obj)
-                identifier = data["url"].rstrip("/").split("/")[-1]
-                prefix = data["url"].rstrip("/").split("/")[-2]
-                url = "/".join([prefix, "{}/".format(identifier.lstrip("/"))])
-                self.client.update(url, data=data)
-                obj.process_status = self.end_status
-                obj.save()
-                update_ids.append(obj.bag_identifier)
-            except Exception as e:
-                raise UpdateRequestError(e)
+        failed = []
+        skipped = []
+        abandoned = []
+        packages = self.select_fields(self.get_queryset())
+        if settings.ISOLATE_FAILURES:
+            skipped = list(packages.waiting().values_list("bag_identifier", flat=True))
+            abandoned = Routine.format_abandoned(packages)
+            packages = packages.eligible()
+        for batch in packages.claim_batches(self.claim_owner, settings.CLAIM_BATCH_SIZE):
+            processed, errors = self.process_batch(batch)
+            update_ids += processed
+            failed += errors
+            if self.progress_callback:
+                self.progress_callback(len(update_ids), len(failed))
+        if settings.ISOLATE_FAILURES:
+            return ("Update requests sent.", {
+                "succeeded": update_ids, "failed": failed, "skipped": skipped, "abandoned": abandoned})
         return ("Update requests sent.", update_ids)
 
+    def get_queryset(self):
+        return Package.objects.filter(process_status=self.start_status, origin="aurora")
+
+    @classmethod
+    def select_fields(cls, packages):
+        """Defers JSON fields which are not sent to Aurora."""
+        return packages.with_json(*cls.json_fields)
+
+    def accepts(self, package):
+        """Returns True if a package is ready to be sent to Aurora."""
+        return package.process_status == self.start_status and package.origin == "aurora"
+
+    def process_batch(self, packages, batch=None):
+        update_ids = []
+        failed = []
+        for obj in packages:
+            self.send_update(obj, update_ids, failed)
+            self.renew_claims()
+        return update_ids, failed
+
+    def raise_errors(self, errors):
+        """Errors are raised as soon as they occur unless failures are isolated."""
+        pass
+
+    def format_failures(self, errors):
+        return errors
+
+    def close(self):
+        pass
+
+    def send_update(self, obj, update_ids, failed):
+        try:
+            data = self.update_data(obj)
+            identifier = data["url"].rstrip("/").split("/")[-1]
+            prefix = data["url"].rstrip("/").split("/")[-2]
+            url = "/".join([prefix, "{}/".format(identifier.lstrip("/"))])
+            self.client.update(url, data=data)
+            obj.process_status = self.end_status
+            obj.clear_failure()
+            obj.save()
+            update_ids.append(obj.bag_identifier)
+        except Exception as e:
+            if not settings.ISOLATE_FAILURES:
+                raise UpdateRequestError(e)
+            obj.record_failure(str(e))
+            failed.append({"identifier": obj.bag_identifier, "error": str(e)})
+
 
 class TransferUpdateRequester(AuroraUpdater):
     """Updates transfer data in Aurora."""
     start_status = Package.DIGITAL_OBJECT_CREATED
     end_status = Package.UPDATE_SENT
+    json_fields = ('data',)
 
     def update_data(self, obj):
         data = obj.data["data"]
@@ -256,8 +1108,115 @@ class AccessionUpdateRequester(AuroraUpdater):
     """Updates accession data in Aurora."""
     start_status = Package.ACCESSION_CREATED
     end_status = Package.ACCESSION_UPDATE_SENT
+    json_fields = ('accession_data',)
 
     def update_data(self, obj):
         data = obj.accession_data["data"]
         data["process_status"] = 30
         return data
+
+
+class Pipeline:
+    """Advances packages through every routine in one pass.
+
+    Packages are claimed in batches, and each batch is passed from one
+    routine to the next in memory, so a package moves on to the next stage as
+    soon as the previous stage succeeds. Routines, and the clients they use,
+    are shared by all batches.
+    """
+
+    stages = (AccessionRoutine, AccessionUpdateRequester, GroupingComponentRoutine,
+              TransferComponentRoutine, DigitalObjectRoutine, TransferUpdateRequester)
+    async_stages = (AsyncAccessionRoutine, AccessionUpdateRequester, AsyncGroupingComponentRoutine,
+                    AsyncTransferComponentRoutine, AsyncDigitalObjectRoutine, TransferUpdateRequester)
+
+    def __init__(self):
+        self.routines = [stage() for stage in (self.async_stages if settings.ASYNC_ROUTINES else self.stages)]
+        self.claim_owner = uuid.uuid4().hex
+        for routine in self.routines:
+            # Routines renew the lease on the packages claimed by the pipeline.
+            routine.claim_owner = self.claim_owner
+        self.progress_callback = None
+
+    def run(self):
+        # Every routine runs on each batch, so JSON fields are loaded in full.
+        packages = reduce(or_, [routine.get_queryset() for routine in self.routines])
+        if settings.ISOLATE_FAILURES:
+            packages = packages.eligible()
+        results = OrderedDict(
+            (type(routine).__name__, {"succeeded": [], "failed": []}) for routine in self.routines)
+        claimed = 0
+        try:
+            for batch in packages.claim_batches(self.claim_owner, settings.CLAIM_BATCH_SIZE, self.claim_related):
+                claimed += len(batch)
+                self.process_batch(batch, results)
+                if self.progress_callback:
+                    self.progress_callback(
+                        claimed, sum(len(result["failed"]) for result in results.values()))
+        finally:
+            for routine in self.routines:
+                routine.close()
+        return ("Pipeline completed.", results)
+
+    def claim_related(self, packages, batch):
+        """Claims pending packages for the same bags as a batch, and then, up
+        to the size of the batch, for the same accessions, so that objects
+        they share are created by one process where possible."""
+        claimed = [p.pk for p in batch]
+        related = list(packages.filter(bag_identifier__in=set(p.bag_identifier for p in batch)).exclude(
+            pk__in=claimed).claim(self.claim_owner))
+        claimed += [p.pk for p in related]
+        accessions = set(p.data["accession"] for p in batch if p.data and p.data.get("accession"))
+        if accessions:
+            related += list(packages.filter(data__accession__in=list(accessions)).exclude(
+                pk__in=claimed).claim(self.claim_owner, len(batch)))
+        return related
+
+    def process_batch(self, packages, results):
+        """Runs each routine on the packages in a batch which are ready for it."""
+        for routine in self.routines:
+            ready = [p for p in packages if routine.accepts(p)]
+            if ready:
+                processed, failed = routine.process_batch(ready, packages)
+                routine.raise_errors(failed)
+                results[type(routine).__name__]["succeeded"] += processed
+                results[type(routine).__name__]["failed"] += routine.format_failures(failed)
+
+
+JOB_ROUTINES = {routine.__name__: routine for routine in (
+    AccessionRoutine, GroupingComponentRoutine, TransferComponentRoutine, DigitalObjectRoutine,
+    AsyncAccessionRoutine, AsyncGroupingComponentRoutine, AsyncTransferComponentRoutine,
+    AsyncDigitalObjectRoutine, TransferUpdateRequester, AccessionUpdateRequester, Pipeline)}
+
+
+def run_job(job):
+    """Runs the routine for a claimed Job, saving progress as each batch of
+    packages is processed, and saves the result on the job.
+
+    A heartbeat is saved on the job from another thread while it runs, so
+    that the job is queued again if the worker stops.
+    """
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=send_heartbeats, args=(job, stop), daemon=True)
+    heartbeat.start()
+    try:
+        routine = JOB_ROUTINES[job.routine]()
+        routine.progress_callback = job.record_progress
+        job.set_claim_owner(routine.claim_owner)
+        job.finish(Job.SUCCEEDED, prepare_response(routine.run()))
+    except Exception as e:
+        message = str(e.args[0]) if e.args else str(e)
+        result = prepare_response((message, e.args[1])) if len(e.args) > 1 else None
+        job.finish(Job.FAILED, result, message)
+    finally:
+        stop.set()
+        heartbeat.join()
+
+
+def send_heartbeats(job, stop):
+    """Saves a heartbeat on a job three times per JOB_LEASE until `stop` is set."""
+    try:
+        while not stop.wait(settings.JOB_LEASE / 3):
+            job.beat()
+    finally:
+        connections.close_all()
@@ -1,6 +1,6 @@
 from rest_framework import serializers
 
-from .models import Package
+from .models import Job, Package
 
 
 class PackageSerializer(serializers.HyperlinkedModelSerializer):
@@ -17,3 +17,27 @@ class PackageListSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Package
         exclude = ('accession_data', 'data')
+
+
+class JobSerializer(serializers.HyperlinkedModelSerializer):
+    status = serializers.CharField(source='get_status_display')
+
+    class Meta:
+        model = Job
+        fields = ('url', 'routine', 'status', 'processed', 'failed', 'result',
+                  'error', 'created', 'started', 'finished', 'heartbeat')
+
+
+class PackageIngestSerializer(serializers.Serializer):
+    """Validates the data for a package sent to the bulk ingest endpoint."""
+    uri = serializers.CharField(max_length=512)
+    identifier = serializers.CharField(max_length=255)
+    package_type = serializers.ChoiceField(choices=Package._meta.get_field('type').choices)
+    origin = serializers.ChoiceField(choices=Package._meta.get_field('origin').choices, default='aurora')
+    archivesspace_uri = serializers.CharField(required=False)
+
+    def validate(self, data):
+        if data['origin'] in Package.DIGITAL_ORIGINS and not data.get('archivesspace_uri'):
+            raise serializers.ValidationError(
+                {'archivesspace_uri': 'This field is required for {} packages.'.format(data['origin'])})
+        return data
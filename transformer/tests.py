@@ -1,19 +1,38 @@
+import asyncio
 import json
+import threading
 import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import StringIO
 from os import listdir
 from os.path import join
+from socketserver import ThreadingMixIn
 
 import vcr
 from aquarius import settings
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework.test import APIRequestFactory
 
-from .models import Package
+from .benchmarks import (compare_selected_bytes, create_backlog,
+                         create_sample_packages, get_samples, json_transform,
+                         measure_backlog_memory, run_benchmarks)
+from .cache import AgentCache
+from .clients import (ArchivesSpaceClient, AsyncAuroraClient,
+                      AsyncUrsaMajorClient, AuroraClient, UrsaMajorClient)
+from .loadtest import ArchivesSpaceStub, AuroraStub, LoadTest
+from .mappings import transform
+from .models import AccessionNumberSequence, AgentReference, Job, Package
 from .routines import (AccessionRoutine, AccessionUpdateRequester,
                        DigitalObjectRoutine, GroupingComponentRoutine,
-                       TransferComponentRoutine, TransferUpdateRequester)
-from .views import (AccessionUpdateRequestView, PackageViewSet,
+                       Pipeline, TransferComponentRoutine,
+                       TransferUpdateRequester)
+from .views import (AccessionUpdateRequestView, PackageViewSet, PipelineView,
                     ProcessAccessionsView, ProcessDigitalObjectsView,
                     ProcessGroupingComponentsView,
                     ProcessTransferComponentsView, TransferUpdateRequestView)
@@ -43,6 +62,7 @@ VIEWS = (
     ('process_digital.json', 'digital-objects', ProcessDigitalObjectsView),
     ('send_update.json', 'send-update', TransferUpdateRequestView),
     ('send_accession_update.json', 'send-accession-update', AccessionUpdateRequestView),
+    ('send_update.json', 'pipeline', PipelineView),
 )
 
 
@@ -88,7 +108,12 @@ class TransformTest(TestCase):
             with transformer_vcr.use_cassette(v[0]):
                 request = self.factory.post(reverse(v[1]))
                 response = v[2].as_view()(request)
+                self.assertEqual(response.status_code, 202, "Wrong HTTP code")
+                job_id = Job.objects.latest("created").pk
+                call_command("run_jobs", once=True, stdout=StringIO())
+                response = self.client.get(reverse('job-detail', args=[job_id]))
                 self.assertEqual(response.status_code, 200, "Wrong HTTP code")
+                self.assertEqual(response.data["status"], "Succeeded", response.data["error"])
 
     def schema(self):
         schema = self.client.get(reverse('schema'))
@@ -105,3 +130,606 @@ class TransformTest(TestCase):
         self.process_views()
         self.schema()
         self.health_check()
+
+
+class PackageTest(TestCase):
+    def test_record_failure(self):
+        package = Package.objects.create(
+            fedora_uri="http://fedora/rest/1", bag_identifier="1",
+            type="aip", process_status=Package.SAVED)
+        package.record_failure("Error")
+        package.record_failure("Another error")
+        package.refresh_from_db()
+        self.assertEqual(package.error_message, "Another error")
+        self.assertEqual(package.attempt_count, 2)
+        self.assertEqual(list(Package.objects.waiting()), [package])
+        self.assertEqual(len(Package.objects.eligible()), 0)
+        package.clear_failure()
+        package.save()
+        self.assertEqual(list(Package.objects.eligible()), [package])
+
+    def test_retry_limits(self):
+        package = Package.objects.create(
+            fedora_uri="http://fedora/rest/1", bag_identifier="1",
+            type="aip", process_status=Package.SAVED)
+        max_attempts = settings.RETRY_MAX_ATTEMPTS
+        settings.RETRY_MAX_ATTEMPTS = 100
+        try:
+            # The uncapped delay would overflow a timedelta.
+            package.attempt_count = 98
+            package.record_failure("Error")
+        finally:
+            settings.RETRY_MAX_ATTEMPTS = max_attempts
+        self.assertLessEqual(package.next_attempt, timezone.now() + timedelta(seconds=settings.RETRY_MAX_DELAY))
+        package.attempt_count = settings.RETRY_MAX_ATTEMPTS - 2
+        package.record_failure("Error")
+        self.assertEqual(list(Package.objects.abandoned()), [])
+        package.record_failure("Error")
+        self.assertIsNone(package.next_attempt)
+        self.assertEqual(list(Package.objects.abandoned()), [package])
+        self.assertEqual(len(Package.objects.eligible()), 0)
+        self.assertEqual(len(Package.objects.waiting()), 0)
+
+    def test_update_data(self):
+        for type in ["aip", "dip"]:
+            Package.objects.create(
+                fedora_uri="http://fedora/rest/{}".format(type), bag_identifier="1",
+                type=type, process_status=Package.SAVED, data={"data": {"title": "Title"}})
+        Package.objects.filter(bag_identifier="1").update_data(
+            ["data", "archivesspace_identifier"], "/repositories/2/archival_objects/1")
+        for package in Package.objects.filter(bag_identifier="1"):
+            self.assertEqual(package.data, {"data": {
+                "title": "Title", "archivesspace_identifier": "/repositories/2/archival_objects/1"}})
+
+    def test_claim(self):
+        for identifier in ["1", "2", "3"]:
+            Package.objects.create(
+                fedora_uri="http://fedora/rest/{}".format(identifier), bag_identifier=identifier,
+                type="aip", process_status=Package.SAVED)
+        first = list(Package.objects.claim("first", 2))
+        second = list(Package.objects.claim("second", 2))
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.assertFalse(set(first) & set(second))
+        self.assertEqual(len(Package.objects.claim("third")), 0)
+        Package.objects.release("first")
+        self.assertEqual(set(Package.objects.claim("third")), set(first))
+        Package.objects.filter(claimed_by="second").update(claimed_until=timezone.now())
+        self.assertEqual(list(Package.objects.claim("fourth")), second)
+        Package.objects.renew("fourth", 600)
+        self.assertGreater(Package.objects.get(claimed_by="fourth").claimed_until,
+                           timezone.now() + timedelta(seconds=500))
+        self.assertEqual(len(Package.objects.claim("fifth")), 0)
+
+    def test_bulk_create(self):
+        packages = []
+        for file in sorted(listdir(join(settings.BASE_DIR, 'fixtures/data'))):
+            with open(join(settings.BASE_DIR, 'fixtures/data/{}'.format(file)), 'r') as json_file:
+                packages.append(json.load(json_file))
+        invalid = {"identifier": "invalid", "package_type": "zip"}
+        response = self.client.post(
+            reverse("package-bulk"), json.dumps([invalid] + packages[:2]), content_type="application/json")
+        self.assertEqual(response.status_code, 200, "Wrong HTTP code")
+        ndjson = "\n".join(json.dumps(package) for package in packages[2:])
+        response = self.client.post(reverse("package-bulk"), ndjson, content_type="application/x-ndjson")
+        self.assertEqual(response.status_code, 200, "Wrong HTTP code")
+        self.assertEqual(Package.objects.count(), len(packages))
+        self.assertFalse(Package.objects.filter(bag_identifier="invalid").exists())
+        for package in packages:
+            new_obj = Package.objects.get(fedora_uri=package["uri"])
+            if package.get("origin") in Package.DIGITAL_ORIGINS:
+                self.assertEqual(new_obj.process_status, Package.TRANSFER_COMPONENT_CREATED)
+                self.assertEqual(new_obj.data["data"]["archivesspace_identifier"], package["archivesspace_uri"])
+            else:
+                self.assertEqual(new_obj.process_status, Package.SAVED)
+        response = self.client.post(
+            reverse("package-bulk"), json.dumps(packages + packages[:1]), content_type="application/json")
+        self.assertEqual(response.status_code, 200, "Wrong HTTP code")
+        response = self.client.post(reverse("package-list"), json.dumps(packages[0]), content_type="application/json")
+        self.assertEqual(response.status_code, 200, "Wrong HTTP code")
+        self.assertEqual(Package.objects.count(), len(packages))
+        response = self.client.post(reverse("package-bulk"), "{", content_type="application/x-ndjson")
+        self.assertEqual(response.status_code, 400, "Wrong HTTP code")
+
+    def test_cursor_pagination(self):
+        for identifier in range(7):
+            Package.objects.create(
+                fedora_uri="http://fedora/rest/{}".format(identifier), bag_identifier=str(identifier),
+                type="aip", process_status=Package.SAVED)
+        Package.objects.filter(bag_identifier__in=["2", "3", "4"]).update(last_modified=timezone.now())
+        expected = list(Package.objects.order_by("-last_modified", "-id").values_list("bag_identifier", flat=True))
+        identifiers = []
+        next_page = "{}?cursor=&page_size=2".format(reverse("package-list"))
+        while next_page:
+            response = self.client.get(next_page)
+            self.assertEqual(response.status_code, 200, "Wrong HTTP code")
+            self.assertNotIn("count", response.data)
+            identifiers += [p["bag_identifier"] for p in response.data["results"]]
+            next_page = response.data["next"]
+        self.assertEqual(identifiers, expected)
+        self.assertEqual(self.client.get(reverse("package-list"), {"cursor": "invalid"}).status_code, 404)
+
+    def test_select_fields(self):
+        packages = create_sample_packages(2)
+        results = {name: (full, selected) for name, full, selected in compare_selected_bytes(packages)}
+        for name, (full, selected) in results.items():
+            self.assertLessEqual(selected, full, name)
+        self.assertLess(results["DigitalObjectRoutine"][1], results["DigitalObjectRoutine"][0])
+        self.assertLess(results["Package list"][1], results["Package list"][0])
+        package = DigitalObjectRoutine.select_fields(
+            packages.filter(process_status=Package.TRANSFER_COMPONENT_CREATED)).first()
+        self.assertEqual(package.get_deferred_fields(), {"data", "accession_data"})
+        self.assertTrue(package.transfer_uri.startswith("/repositories/2/archival_objects/"))
+
+    def test_claim_batches(self):
+        packages = [Package.objects.create(
+            fedora_uri="http://fedora/rest/{}".format(identifier), bag_identifier=str(identifier),
+            type="aip", process_status=Package.SAVED) for identifier in range(5)]
+
+        def claim_last(queryset, batch):
+            if packages[0] not in batch:
+                return []
+            return list(queryset.filter(pk=packages[-1].pk).claim("owner"))
+        batches = []
+        for batch in Package.objects.all().claim_batches("owner", 2, claim_last):
+            self.assertEqual(Package.objects.filter(claimed_by="owner").count(), len(batch))
+            batches.append(sorted(p.bag_identifier for p in batch))
+        self.assertEqual(batches, [["0", "1", "4"], ["2", "3"]])
+        self.assertEqual(Package.objects.filter(claimed_by="owner").count(), 0)
+
+    def test_backlog_memory(self):
+        batched, all_at_once = measure_backlog_memory(create_backlog(40), 5)
+        self.assertLess(batched, all_at_once)
+
+    def test_accession_number_sequence(self):
+        seeds = []
+
+        def seed():
+            seeds.append(1)
+            return 41
+        self.assertEqual(AccessionNumberSequence.next_number(2020, seed), 42)
+        self.assertEqual(AccessionNumberSequence.next_number(2020, seed), 43)
+        self.assertEqual(AccessionNumberSequence.next_number(2021, lambda: 0), 1)
+        self.assertEqual(len(seeds), 1)
+
+
+class JobTest(TestCase):
+    def test_claim_next(self):
+        first = Job.objects.create(routine="AccessionRoutine")
+        second = Job.objects.create(routine="AccessionRoutine")
+        self.assertEqual(Job.objects.claim_next("worker"), first)
+        claimed = Job.objects.claim_next("worker")
+        self.assertEqual(claimed, second)
+        self.assertEqual(claimed.status, Job.RUNNING)
+        self.assertIsNone(Job.objects.claim_next("worker"))
+        claimed.record_progress(3, 1)
+        claimed.finish(Job.FAILED, error="Error")
+        claimed.refresh_from_db()
+        self.assertEqual((claimed.processed, claimed.failed, claimed.error), (3, 1, "Error"))
+
+    def test_requeue_stale(self):
+        job = Job.objects.create(routine="AccessionRoutine")
+        claimed = Job.objects.claim_next("worker")
+        self.assertIsNotNone(claimed.heartbeat)
+        claimed.record_progress(1, 0)
+        self.assertIsNone(Job.objects.claim_next("other"))
+        Job.objects.filter(pk=job.pk).update(
+            heartbeat=timezone.now() - timedelta(seconds=settings.JOB_LEASE + 1))
+        reclaimed = Job.objects.claim_next("other")
+        self.assertEqual((reclaimed, reclaimed.status, reclaimed.worker), (job, Job.RUNNING, "other"))
+        self.assertFalse(Job.objects.stale().exists())
+
+    def test_requeue_releases_claims(self):
+        Package.objects.create(
+            fedora_uri="http://fedora/rest/1", bag_identifier="1", type="aip", process_status=Package.SAVED)
+        Job.objects.create(routine="AccessionRoutine")
+        job = Job.objects.claim_next("worker")
+        job.set_claim_owner("owner")
+        self.assertEqual(len(Package.objects.claim("owner")), 1)
+        Job.objects.filter(pk=job.pk).update(heartbeat=None)
+        self.assertEqual(Job.objects.requeue_stale(), 1)
+        self.assertEqual(Package.objects.filter(claimed_by="owner").count(), 0)
+        self.assertIsNone(Job.objects.get(pk=job.pk).claim_owner)
+
+
+class MigrationTest(TransactionTestCase):
+    before = [("transformer", "0017_auto_20261018_1500")]
+    after = [("transformer", "0018_auto_20261018_1530")]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_remove_duplicate_packages(self):
+        OldPackage = self.migrate(self.before).get_model("transformer", "Package")
+        delivery = {"bag_identifier": "1", "type": "aip", "fedora_uri": "http://fedora/rest/1"}
+        finished = OldPackage.objects.create(
+            process_status=Package.UPDATE_SENT, accession_data={"data": {"archivesspace_identifier": "/accessions/1"}},
+            data={"data": {"archivesspace_parent_identifier": "/archival_objects/1",
+                           "archivesspace_identifier": "/archival_objects/2"}}, **delivery)
+        OldPackage.objects.create(
+            process_status=Package.ACCESSION_UPDATE_SENT, data={"data": {}},
+            accession_data={"data": {"archivesspace_identifier": "/accessions/1"}}, **delivery)
+        OldPackage.objects.create(process_status=Package.ACCESSION_CREATED, data={"data": {}}, **delivery)
+        linked = OldPackage.objects.create(
+            process_status=Package.ACCESSION_CREATED, data={"data": {}},
+            accession_data={"data": {"archivesspace_identifier": "/accessions/2"}},
+            **dict(delivery, bag_identifier="2"))
+        OldPackage.objects.create(**dict(delivery, bag_identifier="2", process_status=Package.ACCESSION_CREATED, data={"data": {}}))
+        OldPackage.objects.create(process_status=Package.SAVED, data={"data": {}}, **dict(delivery, bag_identifier="3"))
+        NewPackage = self.migrate(self.after).get_model("transformer", "Package")
+        self.assertEqual(
+            sorted(NewPackage.objects.values_list("pk", flat=True)),
+            sorted([finished.pk, linked.pk, NewPackage.objects.get(bag_identifier="3").pk]))
+
+
+class TransformationTest(SimpleTestCase):
+    def test_transform(self):
+        samples = get_samples()
+        self.assertTrue(samples)
+        for name, data, from_resource, mapping in samples:
+            self.assertEqual(
+                json.dumps(transform(data, from_resource, mapping)),
+                json.dumps(json_transform(data, from_resource, mapping)), name)
+
+    def test_benchmarks(self):
+        results = run_benchmarks(scale=3, number=1)
+        self.assertIn("Accession", results)
+        self.assertIn("Agent (person)", results)
+        for name, result in results.items():
+            self.assertGreater(result["per_second"], 0, name)
+
+
+class AgentCacheTest(TestCase):
+    def test_agent_cache(self):
+        cache = AgentCache(size=1, ttl=60)
+        cache.set("person", "Jane  Doe", "/agents/people/1")
+        cache.set("organization", "Ford Foundation", "/agents/corporate_entities/1")
+        self.assertEqual(len(cache.entries), 1)
+        self.assertEqual(cache.get("person", "jane doe"), "/agents/people/1")
+        self.assertEqual(cache.get("organization", "Ford Foundation"), "/agents/corporate_entities/1")
+        cache.invalidate("person")
+        self.assertEqual(cache.get("person", "Jane Doe"), None)
+        self.assertEqual(AgentReference.objects.count(), 1)
+        cache.invalidate()
+        self.assertEqual(cache.get("organization", "Ford Foundation"), None)
+
+    def test_long_name(self):
+        cache = AgentCache(size=10, ttl=60)
+        name = "Committee on the History of the Foundation " * 10
+        cache.set("organization", name, "/agents/corporate_entities/1")
+        self.assertEqual(AgentCache(size=10, ttl=60).get("organization", name), "/agents/corporate_entities/1")
+
+    def test_invalidate_other_process(self):
+        self.assertEqual(AgentCache(size=1, ttl=60, local_ttl=3600).local_ttl, 60)
+        cache = AgentCache(size=10, ttl=60)
+        other = AgentCache(size=10, ttl=60, local_ttl=0)
+        cache.set("person", "Jane Doe", "/agents/people/1")
+        self.assertEqual(other.get("person", "Jane Doe"), "/agents/people/1")
+        cache.invalidate()
+        self.assertEqual(other.get("person", "Jane Doe"), None)
+
+
+class StubUrsaMajorHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith("/bags/?id="):
+            identifier = self.path.split("=")[-1]
+            body = {"count": 1, "results": [{"url": "/bags/{}/".format(identifier)}]}
+        else:
+            body = {"identifier": self.path.strip("/").split("/")[-1]}
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(json.dumps(body).encode())
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class AsyncClientTest(SimpleTestCase):
+    def setUp(self):
+        self.server = StubServer(("localhost", 0), StubUrsaMajorHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = AsyncUrsaMajorClient(
+            UrsaMajorClient("http://localhost:{}/".format(self.server.server_port)))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_find_bags(self):
+        async def find_bags():
+            return await asyncio.gather(*[self.client.find_bag_by_id(str(i)) for i in range(5)])
+        loop = asyncio.new_event_loop()
+        try:
+            bags = loop.run_until_complete(find_bags())
+        finally:
+            loop.close()
+        self.assertEqual([b["identifier"] for b in bags], [str(i) for i in range(5)])
+
+    def test_update_transfers(self):
+        aurora = AuroraStub()
+        aurora.start()
+        try:
+            client = AsyncAuroraClient(AuroraClient(aurora.baseurl, "user", "password"))
+
+            async def update_transfers():
+                return await asyncio.gather(
+                    *[client.update("transfers/{}/".format(i), {"process_status": 90}) for i in range(3)])
+            loop = asyncio.new_event_loop()
+            try:
+                results = loop.run_until_complete(update_transfers())
+            finally:
+                loop.close()
+        finally:
+            aurora.stop()
+        self.assertEqual(results, [{"process_status": 90}] * 3)
+        self.assertEqual(len(aurora.requests["PUT /transfers/{id}/"]), 3)
+
+
+class ClientTest(SimpleTestCase):
+    def setUp(self):
+        self.archivesspace = ArchivesSpaceStub(index_lag=60)
+        self.aurora = AuroraStub()
+        for service in (self.archivesspace, self.aurora):
+            service.start()
+        self.aspace_client = ArchivesSpaceClient(self.archivesspace.baseurl, "admin", "password", 2)
+
+    def tearDown(self):
+        for service in (self.archivesspace, self.aurora):
+            service.stop()
+
+    def get_statuses(self, service, endpoint):
+        return [status for _, status in service.requests[endpoint]]
+
+    def test_archivesspace_login(self):
+        self.archivesspace.expired = 1
+        uri = self.aspace_client.create({"title": "Component"}, "component")["uri"]
+        self.assertEqual(uri, "/repositories/2/archival_objects/1")
+        self.assertEqual(len(self.archivesspace.requests["POST /users/admin/login?expiring,password"]), 2)
+        self.assertEqual(
+            self.get_statuses(self.archivesspace, "POST /repositories/{id}/archival_objects"), [412, 200])
+
+    def test_aurora_login(self):
+        client = AuroraClient(self.aurora.baseurl, "user", "password")
+        self.aurora.expired = 1
+        self.assertEqual(client.update("transfers/1/", {"process_status": 90}), {"process_status": 90})
+        self.assertEqual(len(self.aurora.requests["POST /get-token/"]), 2)
+        self.assertEqual(self.get_statuses(self.aurora, "PUT /transfers/{id}/"), [401, 200])
+
+    def test_find_recently_modified(self):
+        self.aspace_client.ID_SET_SIZE = 2
+        for number in range(5):
+            self.aspace_client.create({"title": "Component {}".format(number)}, "component")
+        uri = self.aspace_client.find_recently_modified("component", "title", "Component 3", time.time())
+        self.assertEqual(uri, "/repositories/2/archival_objects/4")
+        endpoint = "GET /repositories/{id}/archival_objects"
+        self.assertEqual(len(self.archivesspace.requests[endpoint + "?all_ids,modified_since"]), 1)
+        # Objects 1 and 2, and then 3 and 4, are fetched.
+        self.assertEqual(len(self.archivesspace.requests[endpoint + "?id_set[]"]), 2)
+
+    def test_recently_created(self):
+        # Created objects are not returned by searches for a minute.
+        for _ in range(2):
+            uri = self.aspace_client.get_or_create(
+                "component", "title", "Component", time.time(), {"title": "Component"})
+            self.assertEqual(uri, "/repositories/2/archival_objects/1")
+        endpoint = "/repositories/{id}/archival_objects"
+        self.assertEqual(len(self.archivesspace.requests["POST " + endpoint]), 1)
+        self.assertEqual(len(self.archivesspace.requests["GET {}?all_ids,modified_since".format(endpoint)]), 1)
+        self.assertEqual(len(self.archivesspace.requests["GET /repositories/{id}/search?aq,page,type[]"]), 2)
+
+
+class ClaimRelatedTest(TestCase):
+    def setUp(self):
+        self.load_test = LoadTest(packages=12, transfers_per_accession=2, agents=2)
+        self.load_test.start()
+        self.load_test.seed()
+
+    def tearDown(self):
+        self.load_test.stop()
+
+    def test_claim_related(self):
+        Package.objects.update(process_status=Package.GROUPING_COMPONENT_CREATED)
+        routines = [TransferComponentRoutine(), TransferComponentRoutine()]
+        claimers = [routine.get_queryset().claim_batches(routine.claim_owner, 3, routine.claim_related)
+                    for routine in routines]
+        batches = []
+        while claimers:
+            for claimer in list(claimers):
+                batch = next(claimer, None)
+                if batch is None:
+                    claimers.remove(claimer)
+                    continue
+                batches.append(batch)
+                Package.objects.filter(pk__in=[p.pk for p in batch]).update(
+                    process_status=Package.TRANSFER_COMPONENT_CREATED)
+        claimed = [p.pk for batch in batches for p in batch]
+        self.assertEqual(sorted(claimed), sorted(Package.objects.values_list("pk", flat=True)))
+        for batch in batches:
+            bags = set(p.bag_identifier for p in batch)
+            self.assertEqual(Package.objects.filter(bag_identifier__in=bags).count(), len(batch))
+
+    def test_accession_lock(self):
+        packages = list(Package.objects.order_by("pk")[:4])
+        first, second = AccessionRoutine(), AccessionRoutine()
+        # The second routine looks for the accession before the first creates it.
+        second.prefetch(packages[2:])
+        first.process_batch(packages[:2])
+        second.process_batch(packages[2:])
+        accessions = [uri for uri in self.load_test.archivesspace.objects if "/accessions/" in uri]
+        self.assertEqual(len(accessions), 1)
+        self.assertEqual(
+            Package.objects.filter(pk__in=[p.pk for p in packages], process_status=Package.ACCESSION_CREATED).count(), 4)
+
+    def test_batch_data_cleared(self):
+        routine = AccessionRoutine()
+        routine.process_batch(list(Package.objects.order_by("pk")[:4]))
+        self.assertEqual(Package.objects.filter(process_status=Package.ACCESSION_CREATED).count(), 4)
+        self.assertEqual((routine.bags, routine.accessions), ({}, {}))
+
+    def test_grouping_component_lock(self):
+        for routine in (AccessionRoutine, AccessionUpdateRequester):
+            routine().run()
+        packages = list(Package.objects.order_by("pk")[:4])
+        # The second routine's packages are loaded before the first creates
+        # the grouping component for their accession.
+        GroupingComponentRoutine().process_batch(packages[:2])
+        GroupingComponentRoutine().process_batch(packages[2:])
+        components = [uri for uri in self.load_test.archivesspace.objects if "/archival_objects/" in uri]
+        self.assertEqual(len(components), 1)
+
+    def test_claim_related_limit(self):
+        Package.objects.update(process_status=Package.ACCESSION_UPDATE_SENT, data={"accession": "/accessions/1/"})
+        routine = GroupingComponentRoutine()
+        batches = routine.get_queryset().claim_batches(routine.claim_owner, 2, routine.claim_related)
+        self.assertEqual(len(next(batches)), 4)
+        batches.close()
+        self.assertEqual(Package.objects.filter(claimed_by=routine.claim_owner).count(), 0)
+
+
+def get_misplaced_digital_objects(load_test):
+    """Returns packages whose digital object is not linked, only once, to
+    their transfer component in the ArchivesSpace stub."""
+    misplaced = []
+    for package in Package.objects.all():
+        instances = load_test.archivesspace.objects[package.data["data"]["archivesspace_identifier"]]["instances"]
+        refs = [i.get("digital_object", {}).get("ref") for i in instances]
+        if refs.count(package.digital_object_uri) != 1:
+            misplaced.append(package)
+    return misplaced
+
+
+class DigitalObjectTest(TestCase):
+    def setUp(self):
+        self.load_test = LoadTest(packages=4, transfers_per_accession=2, agents=2)
+        self.load_test.start()
+        self.load_test.seed()
+        for routine in (AccessionRoutine, AccessionUpdateRequester, GroupingComponentRoutine, TransferComponentRoutine):
+            routine().run()
+
+    def tearDown(self):
+        self.load_test.stop()
+
+    def test_link_conflicts(self):
+        archivesspace = self.load_test.archivesspace
+        # Every attempt to link the first group conflicts with another update.
+        archivesspace.conflicts = 3
+        message, result = DigitalObjectRoutine().run()
+        self.assertEqual((len(result["succeeded"]), len(result["failed"])), (2, 2))
+        self.assertEqual(Package.objects.exclude(digital_object_uri=None).count(), 4)
+        Package.objects.update(next_attempt=None)
+        # The retried link conflicts once, and then succeeds.
+        archivesspace.conflicts = 1
+        message, result = DigitalObjectRoutine().run()
+        self.assertEqual((len(result["succeeded"]), len(result["failed"])), (2, 0))
+        digital_objects = [uri for uri in archivesspace.objects if "/digital_objects/" in uri]
+        self.assertEqual(len(digital_objects), 4)
+        self.assertEqual(Package.objects.filter(process_status=Package.DIGITAL_OBJECT_CREATED).count(), 4)
+        self.assertEqual(get_misplaced_digital_objects(self.load_test), [])
+        self.assertEqual(sorted(Package.objects.values_list("digital_object_uri", flat=True)), sorted(digital_objects))
+
+
+class FailureIsolationTest(TestCase):
+    def setUp(self):
+        self.load_test = LoadTest(packages=8, transfers_per_accession=2, agents=2)
+        self.load_test.start()
+        self.load_test.seed()
+        self.identifier = self.load_test.ursa_major.bags["/bags/1/"]["bag_identifier"]
+
+    def tearDown(self):
+        self.load_test.stop()
+
+    def test_routine_failure(self):
+        del self.load_test.ursa_major.bags["/bags/1/"]
+        message, result = AccessionRoutine().run()
+        self.assertEqual([f["identifier"] for f in result["failed"]], [self.identifier] * 2)
+        self.assertEqual(len(result["succeeded"]), 6)
+        self.assertEqual(result["skipped"], [])
+        self.assertEqual(Package.objects.filter(process_status=Package.ACCESSION_CREATED).count(), 6)
+        for package in Package.objects.filter(bag_identifier=self.identifier):
+            self.assertEqual((package.process_status, package.attempt_count), (Package.SAVED, 1))
+            self.assertTrue(package.error_message)
+        message, result = AccessionRoutine().run()
+        self.assertEqual((result["succeeded"], result["failed"]), ([], []))
+        self.assertEqual(result["skipped"], [self.identifier] * 2)
+
+    def test_update_failure(self):
+        for routine in Pipeline.stages[:5]:
+            routine().run()
+        self.load_test.aurora.missing.add("/transfers/1/")
+        message, result = TransferUpdateRequester().run()
+        self.assertEqual([f["identifier"] for f in result["failed"]], [self.identifier] * 2)
+        self.assertEqual(len(result["succeeded"]), 6)
+        self.assertEqual(Package.objects.filter(process_status=Package.UPDATE_SENT).count(), 6)
+        for package in Package.objects.filter(bag_identifier=self.identifier):
+            self.assertEqual((package.process_status, package.attempt_count), (Package.DIGITAL_OBJECT_CREATED, 1))
+
+
+class LoadTestTest(TestCase):
+    def test_load_test(self):
+        load_test = LoadTest(packages=16, agents=3, index_lag=1)
+        report = load_test.run()
+        self.assertEqual(report["routines"]["Total"]["succeeded"], 16)
+        self.assertEqual(Package.objects.filter(process_status=Package.UPDATE_SENT).count(), 16)
+        self.assertEqual(report["endpoints"]["Aurora PUT /transfers/{id}/"]["requests"], 16)
+        self.assertEqual(report["endpoints"]["ArchivesSpace POST /repositories/{id}/accessions"]["requests"], 2)
+        self.assertEqual(get_misplaced_digital_objects(load_test), [])
+
+    def test_pipeline(self):
+        batch_size = settings.CLAIM_BATCH_SIZE
+        # Small batches split accessions, and the AIP and DIP of bags, across batches.
+        settings.CLAIM_BATCH_SIZE = 5
+        try:
+            load_test = LoadTest(packages=16, agents=3, pipeline=True)
+            report = load_test.run()
+        finally:
+            settings.CLAIM_BATCH_SIZE = batch_size
+        self.assertEqual(list(report["routines"]), ["Pipeline", "Total"])
+        self.assertEqual(report["routines"]["Pipeline"]["succeeded"], 16 * 6)
+        self.assertEqual(report["routines"]["Pipeline"]["failed"], 0)
+        self.assertEqual(Package.objects.filter(process_status=Package.UPDATE_SENT).count(), 16)
+        self.assertEqual(report["endpoints"]["ArchivesSpace POST /repositories/{id}/accessions"]["requests"], 2)
+        self.assertEqual(report["endpoints"]["ArchivesSpace POST /repositories/{id}/archival_objects"]["requests"], 2 + 8)
+        self.assertEqual(get_misplaced_digital_objects(load_test), [])
+
+
+class ConcurrentLoadTestTest(TransactionTestCase):
+    """Runs the load test with settings which process packages in other
+    threads, which only see committed data."""
+
+    def run_load_test(self, options, **kwargs):
+        original = {key: getattr(settings, key) for key in options}
+        for key, value in options.items():
+            setattr(settings, key, value)
+        try:
+            load_test = LoadTest(**kwargs)
+            return load_test, load_test.run()
+        finally:
+            for key, value in original.items():
+                setattr(settings, key, value)
+
+    def assert_completed(self, load_test, report):
+        """Checks that every package was processed, and that each object was
+        created in ArchivesSpace once."""
+        self.assertEqual(report["routines"]["Total"]["succeeded"], 16)
+        self.assertEqual(Package.objects.filter(process_status=Package.UPDATE_SENT).count(), 16)
+        for collection, count in (("accessions", 2), ("archival_objects", 2 + 8), ("digital_objects", 16)):
+            uris = [uri for uri in load_test.archivesspace.objects if "/{}/".format(collection) in uri]
+            self.assertEqual(len(uris), count, collection)
+        self.assertEqual(get_misplaced_digital_objects(load_test), [])
+
+    def test_async_routines(self):
+        self.assert_completed(*self.run_load_test({"ASYNC_ROUTINES": True}, packages=16, agents=3))
+
+    def test_routine_workers(self):
+        self.assert_completed(*self.run_load_test({"ROUTINE_WORKERS": 4}, packages=16, agents=3))
@@ -1,14 +1,47 @@
 from datetime import datetime
 
-from asterism.views import RoutineView, prepare_response
+from aquarius import settings
+from asterism.views import prepare_response
+from rest_framework.decorators import action
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
-from rest_framework.viewsets import ModelViewSet
+from rest_framework.reverse import reverse
+from rest_framework.views import APIView
+from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
-from .models import Package
+from .models import Job, Package
+from .pagination import PackagePagination
+from .parsers import NDJSONParser
 from .routines import (AccessionRoutine, AccessionUpdateRequester,
-                       DigitalObjectRoutine, GroupingComponentRoutine,
+                       AsyncAccessionRoutine, AsyncDigitalObjectRoutine,
+                       AsyncGroupingComponentRoutine,
+                       AsyncTransferComponentRoutine, DigitalObjectRoutine,
+                       GroupingComponentRoutine, Pipeline,
                        TransferComponentRoutine, TransferUpdateRequester)
-from .serializers import PackageListSerializer, PackageSerializer
+from .serializers import (JobSerializer, PackageIngestSerializer,
+                          PackageListSerializer, PackageSerializer)
+
+
+def build_package(data):
+    """Returns an unsaved Package for package data sent in a request. If the
+    data contains `archivesspace_uri`, adds that URI to `data` and sets
+    `process_status` to TRANSFER_COMPONENT_CREATED."""
+    package = Package(
+        fedora_uri=data.get('uri'),
+        bag_identifier=data.get('identifier'),
+        type=data.get('package_type'),
+        process_status=Package.SAVED
+    )
+    if data.get('origin') in Package.DIGITAL_ORIGINS:
+        # TODO: investigate using defaultdict for this
+        package.data = {
+            'data': {
+                'archivesspace_identifier': data['archivesspace_uri']
+            }
+        }
+        package.process_status = Package.TRANSFER_COMPONENT_CREATED
+        package.origin = data.get('origin')
+    return package
 
 
 class PackageViewSet(ModelViewSet):
@@ -18,42 +51,67 @@ class PackageViewSet(ModelViewSet):
     create:
     Creates a Package.
 
+    bulk:
+    Creates Packages from a list of package data, or from newline-delimited
+    JSON, and returns the result for each item.
+
     list:
-    Returns a list of Packages. Accepts query parameter `updated_since`.
+    Returns a list of Packages. Accepts query parameters `updated_since`,
+    `page_size` and `cursor`.
 
     retrieve:
     Returns a single Package, identified by a primary key.
     """
     model = Package
     serializer_class = PackageSerializer
+    pagination_class = PackagePagination
 
     def create(self, request):
-        """Create a package object and based on data supplied with a request. If request
-        data contains `archivesspace_uri`, add that URI to `data` and set
-        `process_status` to TRANSFER_COMPONENT_CREATED."""
+        """Create a package object based on data supplied with a request,
+        unless an identical package already exists."""
         try:
-            source_object = Package.objects.create(
-                fedora_uri=request.data.get('uri'),
-                bag_identifier=request.data.get('identifier'),
-                type=request.data.get('package_type'),
-                process_status=Package.SAVED
-            )
-            if request.data.get('origin') in ['digitization', 'legacy_digital']:
-                # TODO: investigate using defaultdict for this
-                source_object.data = {
-                    'data': {
-                        'archivesspace_identifier': request.data['archivesspace_uri']
-                    }
-                }
-                source_object.process_status = Package.TRANSFER_COMPONENT_CREATED
-                source_object.origin = request.data.get('origin')
-                source_object.save()
-            return Response(prepare_response(("Package created", source_object.bag_identifier)))
+            source_object, created = Package.objects.ingest(build_package(request.data))
+            message = "Package created" if created else "Package already exists"
+            return Response(prepare_response((message, source_object.bag_identifier)))
         except Exception as e:
             return Response(prepare_response("Error creating package: {}".format(str(e))), status=500)
 
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request):
+        """Validates each item of a list of package data, and creates Packages
+        for valid items which do not already exist, with one INSERT per
+        BULK_INGEST_BATCH_SIZE items."""
+        if not isinstance(request.data, list):
+            return Response(prepare_response("Expected a list of packages"), status=400)
+        packages = []
+        valid_results = []
+        results = []
+        for index, item in enumerate(request.data):
+            serializer = PackageIngestSerializer(data=item)
+            if serializer.is_valid():
+                packages.append(build_package(serializer.validated_data))
+                valid_results.append({"index": index, "identifier": item["identifier"]})
+                results.append(valid_results[-1])
+            else:
+                identifier = item.get("identifier") if isinstance(item, dict) else None
+                results.append({"index": index, "identifier": identifier, "created": False,
+                                "errors": serializer.errors})
+        try:
+            created = Package.objects.bulk_ingest(packages, batch_size=settings.BULK_INGEST_BATCH_SIZE)
+        except Exception as e:
+            return Response(prepare_response("Error creating packages: {}".format(str(e))), status=500)
+        for result, package_created in zip(valid_results, created):
+            result["created"] = package_created
+            if not package_created:
+                result["existing"] = True
+        return Response(prepare_response(("{} packages created, {} already existed, {} invalid".format(
+            created.count(True), created.count(False), len(results) - len(packages)), results)))
+
     def get_queryset(self):
-        queryset = Package.objects.all().order_by('-last_modified')
+        queryset = Package.objects.all().order_by('-last_modified', '-id')
+        if self.action == 'list':
+            # The list serializer does not include JSON fields.
+            queryset = queryset.with_json()
         updated_since = self.request.GET.get('updated_since', "")
         if updated_since != "":
             queryset = queryset.filter(last_modified__gte=datetime.fromtimestamp(int(updated_since)))
@@ -65,31 +123,63 @@ class PackageViewSet(ModelViewSet):
         return PackageSerializer
 
 
+class JobViewSet(ReadOnlyModelViewSet):
+    """
+    Endpoint for jobs.
+
+    list:
+    Returns a list of Jobs, most recent first.
+
+    retrieve:
+    Returns the status, progress and results of a single Job, identified by a primary key.
+    """
+    model = Job
+    queryset = Job.objects.all().order_by('-created')
+    serializer_class = JobSerializer
+
+
+class RoutineView(APIView):
+    """Queues a Job which runs `routine` in a worker process, and returns the
+    job's identifier without waiting for the routine to finish."""
+    routine = None
+
+    def post(self, request, format=None):
+        job = Job.objects.create(routine=self.routine.__name__)
+        return Response(
+            prepare_response(("Job queued", job.pk)), status=202,
+            headers={"Location": reverse('job-detail', args=[job.pk], request=request)})
+
+
 class ProcessAccessionsView(RoutineView):
-    """Runs the AccessionRoutine. Accepts POST requests only."""
-    routine = AccessionRoutine
+    """Queues the AccessionRoutine. Accepts POST requests only."""
+    routine = AsyncAccessionRoutine if settings.ASYNC_ROUTINES else AccessionRoutine
 
 
 class ProcessGroupingComponentsView(RoutineView):
-    """Runs the GroupingComponentRoutine. Accepts POST requests only."""
-    routine = GroupingComponentRoutine
+    """Queues the GroupingComponentRoutine. Accepts POST requests only."""
+    routine = AsyncGroupingComponentRoutine if settings.ASYNC_ROUTINES else GroupingComponentRoutine
 
 
 class ProcessTransferComponentsView(RoutineView):
-    """Runs the TransferComponentRoutine. Accepts POST requests only."""
-    routine = TransferComponentRoutine
+    """Queues the TransferComponentRoutine. Accepts POST requests only."""
+    routine = AsyncTransferComponentRoutine if settings.ASYNC_ROUTINES else TransferComponentRoutine
 
 
 class ProcessDigitalObjectsView(RoutineView):
-    """Runs the DigitalObjectRoutine. Accepts POST requests only."""
-    routine = DigitalObjectRoutine
+    """Queues the DigitalObjectRoutine. Accepts POST requests only."""
+    routine = AsyncDigitalObjectRoutine if settings.ASYNC_ROUTINES else DigitalObjectRoutine
 
 
 class TransferUpdateRequestView(RoutineView):
-    """Sends request with updated information to Aurora. Accepts POST requests only."""
+    """Queues a request with updated information to Aurora. Accepts POST requests only."""
     routine = TransferUpdateRequester
 
 
 class AccessionUpdateRequestView(RoutineView):
-    """Sends request with updated information to Aurora. Accepts POST requests only."""
+    """Queues a request with updated information to Aurora. Accepts POST requests only."""
     routine = AccessionUpdateRequester
+
+
+class PipelineView(RoutineView):
+    """Queues the Pipeline, which runs every routine in turn. Accepts POST requests only."""
+    routine = Pipeline